@@ -0,0 +1,173 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import database as db
+from config import MESSAGE_RETENTION_DAYS
+
+# Every query runs on a single dedicated thread, so the event loop never
+# waits on SQLite and all writes are serialized on one pooled connection.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db')
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 5  # seconds between write-behind flushes
+PRUNE_INTERVAL = 3600  # seconds between message journal pruning runs
+_flush_task = None
+_flush_scheduled = None
+
+async def run(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+def _awaitable(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run(func, *args, **kwargs)
+    return wrapper
+
+add_user = _awaitable(db.add_user)
+ban_user = _awaitable(db.ban_user)
+unban_user = _awaitable(db.unban_user)
+ban_in_bot = _awaitable(db.ban_in_bot)
+unban_in_bot = _awaitable(db.unban_in_bot)
+mark_users_unreachable = _awaitable(db.mark_users_unreachable)
+get_users_page = _awaitable(db.get_users_page)
+get_user_count = _awaitable(db.get_user_count)
+get_recipient_ids = _awaitable(db.get_recipient_ids)
+get_stats = _awaitable(db.get_stats)
+add_subscription_plan = _awaitable(db.add_subscription_plan)
+delete_plan = _awaitable(db.delete_plan)
+create_auth_key = _awaitable(db.create_auth_key)
+get_pending_auth_key = _awaitable(db.get_pending_auth_key)
+bot_token_in_use = _awaitable(db.bot_token_in_use)
+activate_auth_key = _awaitable(db.activate_auth_key)
+get_active_auth_keys_page = _awaitable(db.get_active_auth_keys_page)
+revoke_auth_key = _awaitable(db.revoke_auth_key)
+get_clone_bots = _awaitable(db.get_clone_bots)
+expire_auth_keys = _awaitable(db.expire_auth_keys)
+add_payment_request = _awaitable(db.add_payment_request)
+get_pending_payments_page = _awaitable(db.get_pending_payments_page)
+get_payment_by_id = _awaitable(db.get_payment_by_id)
+approve_payment_and_issue_key = _awaitable(db.approve_payment_and_issue_key)
+set_payment_info = _awaitable(db.set_payment_info)
+create_broadcast_job = _awaitable(db.create_broadcast_job)
+checkpoint_broadcast_job = _awaitable(db.checkpoint_broadcast_job)
+get_running_broadcast_jobs = _awaitable(db.get_running_broadcast_jobs)
+get_state_owners = _awaitable(db.get_state_owners)
+load_owner_state = _awaitable(db.load_owner_state)
+drop_state = _awaitable(db.drop_state)
+
+async def is_user_banned(user_id):
+    # Answered from the in-memory ban set, no I/O
+    return db.is_user_banned(user_id)
+
+async def is_banned_in_bot(bot_id, user_id):
+    return db.is_banned_in_bot(bot_id, user_id)
+
+async def _read_through(name, loader):
+    # Cache hits are served on the loop without a DB thread hop
+    hit, value = db.cache_lookup(name)
+    if hit:
+        return value
+    return await run(loader)
+
+async def get_all_plans():
+    return await _read_through('plans', db.get_all_plans)
+
+async def get_payment_info():
+    return await _read_through('payment_info', db.get_payment_info)
+
+async def iter_recipient_chunks(after=0, chunk_size=1000):
+    """Async stream of recipient id chunks; the next chunk is fetched on the DB
+    thread while the caller works through the current one."""
+    pending = asyncio.ensure_future(run(db.get_recipient_ids, after, chunk_size))
+    try:
+        while True:
+            chunk = await pending
+            if not chunk:
+                return
+            pending = asyncio.ensure_future(run(db.get_recipient_ids, chunk[-1], chunk_size))
+            yield chunk
+    finally:
+        pending.cancel()
+
+async def add_reply_routes(bot_id, message_ids, user_id):
+    if db.add_reply_routes(bot_id, message_ids, user_id):
+        _schedule_flush()
+
+async def get_reply_route(bot_id, message_id):
+    # Recent forwards are answered from the LRU on the loop
+    hit, user_id = db.lookup_reply_route(bot_id, message_id)
+    if hit:
+        return user_id
+    return await run(db.get_reply_route, bot_id, message_id)
+
+async def stage_state(bot_id, scope, owner_id, upserts, deletes):
+    if db.stage_state(bot_id, scope, owner_id, upserts, deletes):
+        _schedule_flush()
+
+async def get_ban_stats():
+    return db.get_ban_stats()
+
+async def update_last_active(user_id):
+    # Buffered in memory on the loop; only a full buffer triggers a write
+    if db.update_last_active(user_id):
+        _schedule_flush()
+
+async def journal_message(bot_id, from_user_id, to_user_id, message_type, content):
+    if db.journal_message(bot_id, from_user_id, to_user_id, message_type, content):
+        _schedule_flush()
+
+def _schedule_flush():
+    # A full buffer triggers one early flush, however many writes hit it meanwhile
+    global _flush_scheduled
+    if _flush_scheduled is None or _flush_scheduled.done():
+        _flush_scheduled = asyncio.get_running_loop().create_task(flush())
+
+def _flush_all():
+    db.flush_last_active()
+    db.flush_journal()
+    db.flush_reply_routes()
+    db.flush_state()
+
+async def flush():
+    try:
+        await run(_flush_all)
+    except Exception:
+        logger.exception("Write-behind flush failed")
+
+async def _prune():
+    try:
+        deleted = await run(db.prune_messages, MESSAGE_RETENTION_DAYS)
+        if deleted:
+            logger.info("Pruned %d journal messages", deleted)
+        await run(db.prune_reply_routes, MESSAGE_RETENTION_DAYS)
+    except Exception:
+        logger.exception("Message journal pruning failed")
+
+async def _flush_loop():
+    loop = asyncio.get_running_loop()
+    next_prune = loop.time()
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        await flush()
+        if MESSAGE_RETENTION_DAYS and loop.time() >= next_prune:
+            next_prune = loop.time() + PRUNE_INTERVAL
+            await _prune()
+
+def start():
+    """Start the periodic write-behind flusher (needs a running loop)."""
+    global _flush_task
+    if _flush_task is None:
+        _flush_task = asyncio.get_running_loop().create_task(_flush_loop())
+
+async def close():
+    """Flush pending writes, close the pooled connection and stop the executor."""
+    global _flush_task
+    if _flush_task is not None:
+        _flush_task.cancel()
+        _flush_task = None
+    await flush()
+    await run(db.close_db)
+    _executor.shutdown(wait=True)
@@ -0,0 +1,117 @@
+"""Update throughput at different CONCURRENT_UPDATES, with per-user ordering checked.
+
+Runs a real Application with the bot's UpdateQueue and
+PerUserUpdateProcessor around a stub bot. The handler stands in for a
+DB hop plus an API call with a random 20-80 ms sleep. Every user sends
+the same number of updates, interleaved with the other users' ones.
+
+For every run the handler checks that each user's updates start in
+update_id order and never overlap; any violation is counted and printed.
+A last run sends all updates from one user, which must stay serial
+whatever the concurrency.
+
+    python -m bench.concurrency_load [--users 200] [--per-user 10]
+"""
+import argparse
+import asyncio
+import random
+import time
+import warnings
+
+from telegram import Bot, Chat, Message, Update, User
+from telegram.ext import Application, TypeHandler
+from telegram.warnings import PTBUserWarning
+
+from update_processor import PerUserUpdateProcessor, UpdateQueue
+
+CONCURRENCY = (1, 4, 16, 32, 64)
+
+# Application.stop() starts the updates still queued as untracked tasks;
+# the processor's drain() waits for them, as in main's post_stop
+warnings.filterwarnings("ignore", "Tasks created via `Application.create_task`", PTBUserWarning)
+
+class StubBot(Bot):
+    async def initialize(self):
+        self._bot_user = User(1, "bench", True, username="bench_bot")
+
+    async def shutdown(self):
+        pass
+
+def make_updates(users, per_user):
+    updates = []
+    for _ in range(per_user):
+        for user_id in range(1, users + 1):
+            update_id = len(updates) + 1
+            user = User(user_id, "Bench", False)
+            updates.append(Update(update_id, message=Message(
+                update_id, None, Chat(user_id, Chat.PRIVATE), from_user=user
+            )))
+    return updates
+
+async def run(concurrency, users, per_user):
+    last_seen = {}    # user id -> update_id of their latest started update
+    in_flight = set()
+    violations = []
+    handled = 0
+
+    async def handler(update, context):
+        nonlocal handled
+        user_id = update.effective_user.id
+        if user_id in in_flight:
+            violations.append(f"user {user_id}: update {update.update_id} overlaps another")
+        if last_seen.get(user_id, 0) > update.update_id:
+            violations.append(f"user {user_id}: update {update.update_id} after {last_seen[user_id]}")
+        in_flight.add(user_id)
+        last_seen[user_id] = update.update_id
+        try:
+            await asyncio.sleep(random.uniform(0.02, 0.08))
+        finally:
+            in_flight.discard(user_id)
+        handled += 1
+
+    processor = PerUserUpdateProcessor(concurrency)
+    application = (
+        Application.builder()
+        .bot(StubBot("1:bench"))
+        .update_queue(UpdateQueue(1000, max_taken=1000))
+        .concurrent_updates(processor)
+        .build()
+    )
+    application.add_handler(TypeHandler(Update, handler))
+    updates = make_updates(users, per_user)
+
+    await application.initialize()
+    await application.start()
+    started = time.perf_counter()
+    for update in updates:
+        await application.update_queue.put(update)
+    await application.stop()
+    await processor.drain()
+    elapsed = time.perf_counter() - started
+    await application.shutdown()
+
+    print(f"concurrency {concurrency:3d}  users {users:4d}  {len(updates) / elapsed:7.0f} updates/s  "
+          f"handled {handled}/{len(updates)}  order violations {len(violations)}  "
+          f"locks left {processor.active_users()}")
+    for violation in violations[:5]:
+        print("   ", violation)
+    return not violations and handled == len(updates)
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--per-user", type=int, default=10)
+    args = parser.parse_args()
+
+    ok = True
+    for concurrency in CONCURRENCY:
+        # At concurrency 1 every update takes ~50 ms, so fewer users keep the run short
+        users = min(args.users, 20) if concurrency == 1 else args.users
+        ok &= await run(concurrency, users, args.per_user)
+    # One user's burst stays serial and ordered however many slots there are
+    ok &= await run(CONCURRENCY[-1], 1, 50)
+    if not ok:
+        raise SystemExit("per-user ordering was broken or updates were lost")
+
+if __name__ == "__main__":
+    asyncio.run(main())
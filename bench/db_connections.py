@@ -0,0 +1,97 @@
+"""Query throughput with a connection per call vs the pooled per-thread connection.
+
+Runs the two hottest queries of the original handlers, the ban check on
+every message and the last-active touch, through:
+
+- before: get_db() as it was, sqlite3.connect() and close() around every
+  query, on a database in SQLite's default rollback-journal mode
+- after: database.get_db(), the long-lived per-thread connection opened
+  with the WAL and cache PRAGMAS
+
+Each database is a fresh file with 10k users in a temporary directory.
+Both functions now skip SQLite (in-memory ban set, buffered touches), so
+the script runs their former queries directly.
+
+    python -m bench.db_connections [--seconds 2]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import database
+
+USERS = 10_000
+
+@contextmanager
+def connect_per_call():
+    conn = sqlite3.connect(database.DB_NAME)
+    conn.row_factory = sqlite3.Row
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def is_user_banned(get_db, user_id):
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT is_banned FROM users WHERE user_id = ?', (user_id,))
+        result = cursor.fetchone()
+        return result and result['is_banned'] == 1
+
+def update_last_active(get_db, user_id):
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('UPDATE users SET last_active = ? WHERE user_id = ?', (datetime.now().isoformat(), user_id))
+        conn.commit()
+
+def ops_per_second(func, get_db, seconds):
+    ops = 0
+    started = time.perf_counter()
+    deadline = started + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            func(get_db, random.randint(1, USERS))
+        ops += 100
+    return ops / (time.perf_counter() - started)
+
+def create(path, wal):
+    database.DB_NAME = path
+    database.init_db()
+    with database.get_db() as conn:
+        conn.executemany(
+            'INSERT INTO users (user_id, username, first_name, join_date, last_active) VALUES (?, ?, ?, ?, ?)',
+            [(user_id, f"user{user_id}", "User", "", "") for user_id in range(1, USERS + 1)]
+        )
+        conn.commit()
+    database.close_db()
+    if not wal:
+        # init_db() went through the pool, which switched the file to WAL
+        conn = sqlite3.connect(path)
+        conn.execute('PRAGMA journal_mode = DELETE')
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--seconds", type=float, default=2, help="per query and mode")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = {}
+        for mode, wal, get_db in (("before", False, connect_per_call), ("after", True, database.get_db)):
+            create(os.path.join(directory, f"{mode}.db"), wal)
+            for func in (is_user_banned, update_last_active):
+                results[mode, func.__name__] = ops_per_second(func, get_db, args.seconds)
+            database.close_db()
+
+    print(f"{'ops/s':20s} {'before':>9s} {'after':>9s} {'speedup':>8s}")
+    for name in ("is_user_banned", "update_last_active"):
+        before, after = results["before", name], results["after", name]
+        print(f"{name:20s} {before:9.0f} {after:9.0f} {after / before:7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Cost of persisting user_data for 100k users with SQLitePersistence.
+
+Gives SQLitePersistence a persistence pass the way PTB does every
+update_interval: update_user_data() with a deep copy of each touched
+user's dict. Then times the write-behind flush that puts the changes in
+conversation_state. Each user has the bot's four workflow keys. For
+comparison, a PicklePersistence-style save re-pickles every user's dict
+to a file on each pass.
+
+The database is a fresh file in a temporary directory.
+
+    python -m bench.persistence_flush [--users 100000] [--dirty 1000]
+"""
+import argparse
+import asyncio
+import os
+import pickle
+import random
+import tempfile
+import time
+from copy import deepcopy
+from types import SimpleNamespace
+
+import async_db
+import database
+from persistence import SQLitePersistence
+
+def workflow_state(user_id):
+    return {
+        'awaiting_payment_screenshot': user_id % 3 == 0,
+        'selected_plan': user_id % 5,
+        'awaiting_bot_token': None,
+        'broadcast_mode': False,
+    }
+
+async def persist(persistence, data, user_ids):
+    """One persistence pass over user_ids, then the flush; returns (pass ms, flush ms)."""
+    copies = [(user_id, deepcopy(data[user_id])) for user_id in user_ids]
+    started = time.perf_counter()
+    for user_id, copy in copies:
+        await persistence.update_user_data(user_id, copy)
+    passed = time.perf_counter()
+    # Runs after any early flush a full buffer started, on the same DB thread
+    await async_db.flush()
+    flushed = time.perf_counter()
+    return (passed - started) * 1000, (flushed - passed) * 1000
+
+async def main(args, directory):
+    database.DB_NAME = os.path.join(directory, "bench.db")
+    database.init_db()
+    persistence = SQLitePersistence()
+    persistence.set_bot(SimpleNamespace(id=1))
+    await persistence.get_user_data()
+
+    data = {user_id: workflow_state(user_id) for user_id in range(1, args.users + 1)}
+    all_ids = list(data)
+    dirty = random.sample(all_ids, args.dirty)
+
+    started = time.perf_counter()
+    with open(os.path.join(directory, "pickle"), "wb") as file:
+        pickle.dump(data, file)
+    print(f"full re-pickle of {args.users} users (PicklePersistence-style): "
+          f"{(time.perf_counter() - started) * 1000:.0f} ms\n")
+
+    steps = (
+        (f"first pass, all {args.users} users written", all_ids, None),
+        (f"{args.dirty} users, one key changed each", dirty, lambda state: state.update(selected_plan=99)),
+        (f"{args.dirty} users touched, nothing changed", dirty, None),
+        (f"{args.users} users touched, nothing changed", all_ids, None),
+        (f"{args.users} users, one key changed each", all_ids, lambda state: state.update(broadcast_mode=True)),
+    )
+    print(f"{'persistence pass':44s} {'diff ms':>8s} {'flush ms':>9s}")
+    for label, user_ids, change in steps:
+        if change:
+            for user_id in user_ids:
+                change(data[user_id])
+        diff_ms, flush_ms = await persist(persistence, data, user_ids)
+        print(f"{label:44s} {diff_ms:8.1f} {flush_ms:9.1f}")
+
+    started = time.perf_counter()
+    owners = await async_db.get_state_owners(1, 'user')
+    print(f"\nstartup, ids with stored state: {(time.perf_counter() - started) * 1000:.0f} ms "
+          f"({len(owners)} users)")
+    started = time.perf_counter()
+    await async_db.load_owner_state(1, 'user', dirty[0])
+    print(f"one user's state on their next update: {(time.perf_counter() - started) * 1000:.2f} ms")
+    await async_db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--dirty", type=int, default=1000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        asyncio.run(main(args, directory))
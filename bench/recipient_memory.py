@@ -0,0 +1,88 @@
+"""Peak memory of walking every broadcast recipient, streamed vs loaded at once.
+
+Fills a fresh database in a temporary directory with 1M users (1% banned,
+1% unreachable), then measures with tracemalloc, one at a time:
+
+- iter_recipient_chunks in database (sync, as resumed jobs count them)
+- iter_recipient_chunks in async_db, the path broadcast.run_job sends from
+- the whole-table load broadcasts used before: every column of every
+  recipient row fetched at once, as the removed get_all_users() did
+
+tracemalloc sees Python allocations on every thread, not SQLite's own
+page cache, which is the same for all three.
+
+    python -m bench.recipient_memory [--users 1000000] [--chunk-size 1000]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import async_db
+import database
+
+def populate(users):
+    now = datetime.now().isoformat()
+    with database.get_db() as conn:
+        for start in range(1, users + 1, 100_000):
+            conn.executemany(
+                'INSERT INTO users (user_id, username, first_name, is_banned, join_date, last_active, is_reachable) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (
+                    (user_id, f"user{user_id}", f"User {user_id}", int(user_id % 100 == 0), now, now,
+                     int(user_id % 100 != 1))
+                    for user_id in range(start, min(start + 100_000, users + 1))
+                )
+            )
+        conn.commit()
+
+def measure(label, func):
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    count = func()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1] - before
+    print(f"{label:44s} {count:9d} recipients  peak {peak / 1024:10.0f} KiB  {elapsed:6.2f} s")
+
+def stream_sync(chunk_size):
+    return sum(len(chunk) for chunk in database.iter_recipient_chunks(chunk_size=chunk_size))
+
+def stream_async(chunk_size):
+    async def walk():
+        count = 0
+        async for chunk in async_db.iter_recipient_chunks(chunk_size=chunk_size):
+            count += len(chunk)
+        return count
+    return asyncio.run(walk())
+
+def load_all():
+    with database.get_db() as conn:
+        rows = conn.execute('SELECT * FROM users WHERE is_banned = 0 AND is_reachable = 1').fetchall()
+        return len(rows)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database.DB_NAME = os.path.join(directory, "bench.db")
+        database.init_db()
+        started = time.perf_counter()
+        populate(args.users)
+        print(f"{args.users} users inserted in {time.perf_counter() - started:.1f} s\n")
+
+        tracemalloc.start()
+        measure(f"database.iter_recipient_chunks({args.chunk_size})", lambda: stream_sync(args.chunk_size))
+        measure(f"async_db.iter_recipient_chunks({args.chunk_size})", lambda: stream_async(args.chunk_size))
+        measure("whole table at once (old get_all_users)", load_all)
+        tracemalloc.stop()
+        database.close_db()
+
+if __name__ == "__main__":
+    main()
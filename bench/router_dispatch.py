@@ -0,0 +1,73 @@
+"""Callback dispatch cost: CallbackRouter vs the if/elif chain it replaced.
+
+For growing numbers of actions, half exact and half prefixed with an int
+argument, times resolving the chain's worst case (the last prefixed
+action) with a linear startswith() chain and with CallbackRouter, plus
+an exact action through the router. Then times the bot's real table,
+main.callbacks, on a few of its own callbacks.
+
+    python -m bench.router_dispatch
+"""
+import random
+import timeit
+
+from router import CallbackRouter
+
+SIZES = (10, 25, 50, 100, 200)
+WORDS = ("plan", "user", "key", "pay", "item", "order", "note", "task", "file", "tag", "page", "msg")
+NUMBER = 20000
+
+def per_call_ns(func):
+    return min(timeit.repeat(func, number=NUMBER, repeat=5)) / NUMBER * 1e9
+
+async def handler(*args):
+    pass
+
+def synthetic(size):
+    random.seed(size)
+    names = [f"{random.choice(WORDS)}{i}_action_" for i in range(size)]
+    router = CallbackRouter()
+    chain = []
+    for i, name in enumerate(names):
+        if i % 2:
+            router.add(name.rstrip("_"), handler)
+            chain.append((name.rstrip("_"), False))
+        else:
+            router.add_prefix(name, handler, int)
+            chain.append((name, True))
+
+    def old_dispatch(data):
+        # What the handlers did before: one comparison per action, in order
+        for name, prefixed in chain:
+            if not prefixed:
+                if data == name:
+                    return handler, ()
+            elif data.startswith(name):
+                return handler, (int(data[len(name):]),)
+        return None
+
+    last_prefixed = [name for name, prefixed in chain if prefixed][-1] + "123"
+    last_exact = [name for name, prefixed in chain if not prefixed][-1]
+    assert old_dispatch(last_prefixed) == router.resolve(last_prefixed)
+    return (
+        per_call_ns(lambda: old_dispatch(last_prefixed)),
+        per_call_ns(lambda: router.resolve(last_prefixed)),
+        per_call_ns(lambda: router.resolve(last_exact)),
+        len(router._lengths),
+    )
+
+def main():
+    print("ns per dispatch, worst case for the chain")
+    print(f"{'actions':>8} {'if/elif':>9} {'router prefix+int':>18} {'router exact':>13} {'prefix lengths':>15}")
+    for size in SIZES:
+        chain_ns, prefix_ns, exact_ns, lengths = synthetic(size)
+        print(f"{size:8d} {chain_ns:9.0f} {prefix_ns:18.0f} {exact_ns:13.0f} {lengths:15d}")
+
+    import main as bot
+    print(f"\nmain.callbacks: {len(bot.callbacks._exact)} exact actions, "
+          f"{len(bot.callbacks._prefixes)} prefixes, {len(bot.callbacks._lengths)} prefix lengths")
+    for data in ("owner_panel", "unban_123456789", "pg_k_n_AbC_dEf", "unban_1_2", "no_such_action"):
+        print(f"  {data:18s} {per_call_ns(lambda: bot.callbacks.resolve(data)):6.0f} ns")
+
+if __name__ == "__main__":
+    main()
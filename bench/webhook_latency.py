@@ -0,0 +1,199 @@
+"""Update latency with the webhook server vs long polling.
+
+Runs the bot's real PTB stack (UpdateQueue, PerUserUpdateProcessor,
+Updater) around a stub bot that never talks to Telegram, feeds it
+synthetic updates at a fixed rate and measures the time from "Telegram
+has the update" to the start of the handler.
+
+- webhook: each update is POSTed to the PTB webhook server with the
+  secret token header, as Telegram does. A request with a wrong secret
+  is checked to get 403 first.
+- polling: getUpdates is answered by a fake Telegram that holds each
+  long poll until an update arrives, as the real one does.
+
+--rtt simulates the network round trip to Telegram. A webhook request
+takes half of it to arrive, and so does a long poll's answer; after each
+answer the next getUpdates takes the other half to reach Telegram, and
+updates arriving meanwhile wait there.
+
+    python -m bench.webhook_latency [--updates 500] [--interval 5] [--rtt 50]
+"""
+import argparse
+import asyncio
+import http.client
+import json
+import socket
+import statistics
+import time
+
+from telegram import Bot, Update, User
+from telegram.ext import Application, TypeHandler
+
+from update_processor import PerUserUpdateProcessor, UpdateQueue
+
+SECRET = "bench-secret"
+URL_PATH = "telegram"
+
+class StubBot(Bot):
+    """Bot whose getUpdates is served by a FakeTelegram; no other API call is made."""
+
+    def __init__(self, telegram):
+        super().__init__("1:bench")
+        with self._unfrozen():
+            self.telegram = telegram
+
+    async def initialize(self):
+        self._bot_user = User(1, "bench", True, username="bench_bot")
+
+    async def shutdown(self):
+        pass
+
+    async def set_webhook(self, *args, **kwargs):
+        return True
+
+    async def delete_webhook(self, *args, **kwargs):
+        return True
+
+    async def get_updates(self, offset=None, timeout=0, **kwargs):
+        return await self.telegram.get_updates(self, offset or 0, timeout)
+
+class FakeTelegram:
+    """Pending updates, handed out to long polls the way the Bot API does."""
+
+    def __init__(self, rtt):
+        self.rtt = rtt
+        self.pending = []
+        self.arrived = asyncio.Event()
+
+    def push(self, data):
+        self.pending.append(data)
+        self.arrived.set()
+
+    async def get_updates(self, bot, offset, timeout):
+        await asyncio.sleep(self.rtt / 2)  # the request travelling to Telegram
+        self.pending = [data for data in self.pending if data['update_id'] >= offset]
+        if not self.pending and timeout:
+            self.arrived.clear()
+            try:
+                await asyncio.wait_for(self.arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        batch = self.pending[:100]
+        await asyncio.sleep(self.rtt / 2)  # the answer travelling back
+        return [Update.de_json(data, bot) for data in batch]
+
+def update_data(update_id):
+    user = {"id": 1000 + update_id % 50, "is_bot": False, "first_name": "Bench"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": int(time.time()), "text": "hi",
+            "chat": {"id": user["id"], "type": "private"}, "from": user,
+        },
+    }
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def build(bot, latencies, sent):
+    async def handler(update, context):
+        latencies.append(time.perf_counter() - sent[update.update_id])
+
+    application = (
+        Application.builder()
+        .bot(bot)
+        .update_queue(UpdateQueue(1000, max_taken=1000))
+        .concurrent_updates(PerUserUpdateProcessor(32))
+        .build()
+    )
+    application.add_handler(TypeHandler(Update, handler))
+    return application
+
+async def run_webhook(args):
+    latencies, sent = [], {}
+    application = build(StubBot(None), latencies, sent)
+    port = free_port()
+    loop = asyncio.get_running_loop()
+
+    def post(update_id, secret=SECRET):
+        sent[update_id] = time.perf_counter()
+        time.sleep(args.rtt / 2)  # Telegram's request travelling to us
+        connection = http.client.HTTPConnection("127.0.0.1", port)
+        try:
+            connection.request("POST", f"/{URL_PATH}", json.dumps(update_data(update_id)), {
+                "Content-Type": "application/json",
+                "X-Telegram-Bot-Api-Secret-Token": secret,
+            })
+            response = connection.getresponse()
+            response.read()
+            return response.status
+        finally:
+            connection.close()
+
+    await application.initialize()
+    await application.start()
+    await application.updater.start_webhook(
+        listen="127.0.0.1", port=port, url_path=URL_PATH,
+        webhook_url=f"https://example.invalid/{URL_PATH}", secret_token=SECRET
+    )
+    try:
+        status = await loop.run_in_executor(None, post, 0, "wrong-secret")
+        assert status == 403, f"wrong secret got HTTP {status}"
+        sent.pop(0)
+
+        posts = []
+        for update_id in range(1, args.updates + 1):
+            posts.append(loop.run_in_executor(None, post, update_id))
+            await asyncio.sleep(args.interval)
+        statuses = await asyncio.gather(*posts)
+        assert set(statuses) == {200}, f"webhook answered {set(statuses)}"
+    finally:
+        await application.updater.stop()
+        await application.stop()
+        await application.shutdown()
+    return latencies
+
+async def run_polling(args):
+    latencies, sent = [], {}
+    telegram = FakeTelegram(args.rtt)
+    application = build(StubBot(telegram), latencies, sent)
+
+    await application.initialize()
+    await application.start()
+    await application.updater.start_polling(poll_interval=0, timeout=10)
+    try:
+        for update_id in range(1, args.updates + 1):
+            sent[update_id] = time.perf_counter()
+            telegram.push(update_data(update_id))
+            await asyncio.sleep(args.interval)
+        while len(latencies) < args.updates:
+            await asyncio.sleep(0.05)
+    finally:
+        await application.updater.stop()
+        await application.stop()
+        await application.shutdown()
+    return latencies
+
+def report(mode, latencies):
+    ms = sorted(latency * 1000 for latency in latencies)
+    p99 = ms[min(len(ms) - 1, int(len(ms) * 0.99))]
+    print(f"{mode:8s} n={len(ms):5d}  p50={statistics.median(ms):7.2f} ms  "
+          f"p99={p99:7.2f} ms  max={ms[-1]:7.2f} ms")
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--updates", type=int, default=500)
+    parser.add_argument("--interval", type=float, default=5, help="ms between updates")
+    parser.add_argument("--rtt", type=float, default=0, help="simulated round trip to Telegram, ms")
+    args = parser.parse_args()
+    args.interval /= 1000
+    args.rtt /= 1000
+
+    print(f"{args.updates} updates, one every {args.interval * 1000:g} ms, rtt {args.rtt * 1000:g} ms")
+    report("webhook", await run_webhook(args))
+    report("polling", await run_polling(args))
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import time
+from contextlib import aclosing
+from telegram.error import BadRequest, Forbidden
+import async_db as db
+import relay
+from outbox import LOW
+
+logger = logging.getLogger(__name__)
+
+CONCURRENCY = 10  # broadcast sends queued in the outbox at once
+CHECKPOINT_EVERY = 100  # recipients per chunk; the cursor is saved after each
+PROGRESS_INTERVAL = 5   # seconds between progress message edits
+
+_jobs = {}  # job id -> running task
+_stopping = asyncio.Event()
+
+SENT, FAILED, UNREACHABLE = 'sent', 'failed', 'unreachable'
+
+# BadRequest messages that mean the chat is gone for good
+UNREACHABLE_ERRORS = ('chat not found', 'user is deactivated', 'peer_id_invalid')
+
+def classify_error(error):
+    """UNREACHABLE if retrying this chat later is pointless, else FAILED."""
+    if isinstance(error, Forbidden):
+        return UNREACHABLE
+    if isinstance(error, BadRequest) and any(m in error.message.lower() for m in UNREACHABLE_ERRORS):
+        return UNREACHABLE
+    return FAILED
+
+async def _send_one(send, chat_id):
+    # Rate limiting, RetryAfter and network retries are handled by the outbox
+    try:
+        await send(chat_id)
+        return SENT
+    except Exception as e:
+        logger.debug("Broadcast to %s failed: %s", chat_id, e)
+        return classify_error(e)
+
+async def run_broadcast(send, recipients):
+    """Call send(chat_id) for every recipient.
+    
+    Returns (success, failed, unreachable) where unreachable lists the chat
+    ids that blocked the bot or no longer exist.
+    """
+    counts = {SENT: 0, FAILED: 0}
+    unreachable = []
+    recipients = iter(recipients)
+
+    async def worker():
+        for chat_id in recipients:
+            result = await _send_one(send, chat_id)
+            if result == UNREACHABLE:
+                unreachable.append(chat_id)
+            else:
+                counts[result] += 1
+
+    await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+    return counts[SENT], counts[FAILED], unreachable
+
+async def send_payload(bot, chat_id, payload):
+    """Deliver a stored broadcast payload to one chat."""
+    kind = payload['kind']
+    if kind == 'text':
+        await bot.send_message(chat_id=chat_id, text=payload['text'], parse_mode='HTML')
+    elif kind == 'copy':
+        await bot.copy_message(
+            chat_id,
+            payload['from_chat_id'],
+            payload['message_id'],
+            caption=payload['caption'],
+            parse_mode='HTML'
+        )
+    elif kind == 'album':
+        await relay.send_album(bot, chat_id, payload['media'])
+    elif kind == 'forward':
+        await bot.forward_message(
+            chat_id=chat_id,
+            from_chat_id=payload['from_chat_id'],
+            message_id=payload['message_id']
+        )
+    else:
+        send_media = getattr(bot, f"send_{kind}")
+        await send_media(chat_id, payload['file_id'], caption=payload['caption'], parse_mode='HTML')
+
+def _counts_text(job):
+    return (
+        f"Sent: {job['sent']}\n"
+        f"Failed: {job['failed']}\n"
+        f"Pruned (blocked/deleted): {job['pruned']}"
+    )
+
+def _progress_text(job, started_at, done_at_start, finished=False):
+    done = job['sent'] + job['failed'] + job['pruned']
+    remaining = max(job['total'] - done, 0)
+    text = f"{'✅ Broadcast complete!' if finished else '📢 Broadcasting...'}\n\n{_counts_text(job)}"
+    if not finished:
+        rate = (done - done_at_start) / max(time.monotonic() - started_at, 1e-6)
+        eta = f"{int(remaining / rate) // 60}m {int(remaining / rate) % 60}s" if rate else "…"
+        text += f"\nRemaining: {remaining}\nETA: {eta}"
+    return text
+
+async def _show_progress(outbox, job, text):
+    try:
+        await outbox.sender().edit_message_text(
+            chat_id=job['owner_chat_id'],
+            message_id=job['progress_message_id'],
+            text=text
+        )
+    except Exception as e:
+        logger.debug("Could not update broadcast progress: %s", e)
+
+async def run_job(outbox, job):
+    """Send a broadcast job chunk by chunk, checkpointing after each chunk."""
+    started_at = time.monotonic()
+    done_at_start = job['sent'] + job['failed'] + job['pruned']
+    last_progress = started_at
+
+    sender = outbox.sender(LOW)
+
+    async def send(chat_id):
+        await send_payload(sender, chat_id, job['payload'])
+
+    async with aclosing(db.iter_recipient_chunks(job['cursor'], CHECKPOINT_EVERY)) as chunks:
+        async for recipients in chunks:
+            if _stopping.is_set():
+                # Shutting down: the job stays 'running' and resumes from its cursor
+                return
+            success, failed, unreachable = await run_broadcast(send, recipients)
+            if unreachable:
+                await db.mark_users_unreachable(unreachable)
+            job['sent'] += success
+            job['failed'] += failed
+            job['pruned'] += len(unreachable)
+            job['cursor'] = recipients[-1]
+            await db.checkpoint_broadcast_job(job['id'], job['cursor'], job['sent'], job['failed'], job['pruned'])
+            if time.monotonic() - last_progress >= PROGRESS_INTERVAL:
+                last_progress = time.monotonic()
+                await _show_progress(outbox, job, _progress_text(job, started_at, done_at_start))
+
+    await db.checkpoint_broadcast_job(job['id'], job['cursor'], job['sent'], job['failed'], job['pruned'], status='done')
+    await _show_progress(outbox, job, _progress_text(job, started_at, done_at_start, finished=True))
+
+async def _fail_job(outbox, job, error):
+    # Marked failed rather than left running, so a job that cannot be sent
+    # (e.g. a bad payload) does not restart with every process
+    try:
+        await db.checkpoint_broadcast_job(
+            job['id'], job['cursor'], job['sent'], job['failed'], job['pruned'], status='failed'
+        )
+    except Exception:
+        logger.exception("Could not mark broadcast job %s failed", job['id'])
+    await _show_progress(outbox, job, f"❌ Broadcast stopped: {error}\n\n{_counts_text(job)}")
+
+def _job_done(outbox, job, task):
+    _jobs.pop(job['id'], None)
+    if task.cancelled() or task.exception() is None:
+        return
+    logger.error("Broadcast job %s failed", job['id'], exc_info=task.exception())
+    asyncio.get_running_loop().create_task(_fail_job(outbox, job, task.exception()))
+
+def _spawn(outbox, job):
+    # Plain loop tasks rather than application.create_task, which would make
+    # Application.stop() wait for the whole broadcast to finish
+    task = asyncio.get_running_loop().create_task(run_job(outbox, job))
+    _jobs[job['id']] = task
+    task.add_done_callback(lambda done: _job_done(outbox, job, done))
+    return task
+
+async def start_broadcast(outbox, owner_chat_id, payload):
+    """Persist a broadcast job for every active user and start sending it."""
+    total = await db.get_user_count()
+    progress = await outbox.sender().send_message(owner_chat_id, f"📢 Broadcasting to {total} users in the background...")
+    job_id = await db.create_broadcast_job(owner_chat_id, payload, total, progress.message_id)
+    _spawn(outbox, {
+        'id': job_id, 'owner_chat_id': owner_chat_id, 'payload': payload, 'cursor': 0,
+        'total': total, 'sent': 0, 'failed': 0, 'pruned': 0, 'progress_message_id': progress.message_id,
+    })
+
+async def resume_jobs(outbox):
+    """Restart every broadcast job left running by a previous process."""
+    _stopping.clear()
+    for job in await db.get_running_broadcast_jobs():
+        if job['id'] not in _jobs:
+            logger.info("Resuming broadcast job %s from user %s", job['id'], job['cursor'])
+            _spawn(outbox, job)
+
+async def stop_jobs():
+    """Let running jobs checkpoint their current chunk and exit."""
+    _stopping.set()
+    await asyncio.gather(*_jobs.values(), return_exceptions=True)
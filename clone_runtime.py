@@ -0,0 +1,263 @@
+import asyncio
+import html
+import logging
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import (
+    Application, CallbackQueryHandler, CommandHandler, ContextTypes, MessageHandler, TypeHandler, filters
+)
+from telegram.request import HTTPXRequest
+from config import CLONE_CONNECTION_POOL
+import async_db as db
+import flood
+import outbox
+from handlers import owner_handlers, user_handlers
+from persistence import SQLitePersistence
+from router import CallbackRouter
+from update_processor import PerUserUpdateProcessor
+from user_state import IdleEviction, UserState
+
+logger = logging.getLogger(__name__)
+
+CONCURRENT_UPDATES = 8       # per clone
+STARTUP_CONCURRENCY = 10     # clones initialized at once when the process starts
+EXPIRY_CHECK_INTERVAL = 600  # seconds between subscription expiry checks
+ALLOWED_UPDATES = ["message", "callback_query"]
+
+class SharedRequest(HTTPXRequest):
+    """HTTPXRequest used for the API calls of every clone bot.
+
+    A bot shuts its requests down when it stops; this one has to stay open
+    for the other clones, so only close() releases the connection pool.
+    """
+
+    __slots__ = ()
+
+    async def shutdown(self):
+        pass
+
+    async def close(self):
+        await super().shutdown()
+
+_request = None   # SharedRequest, created with the first clone
+_clones = {}      # auth key -> running Application
+_starting = set()
+_main = None      # the main bot's application, which notifies clone owners
+_tasks = []
+
+def _shared_request():
+    global _request
+    if _request is None:
+        # Many clones contend for the pool, so wait longer than the default 1s for a connection
+        _request = SharedRequest(connection_pool_size=CLONE_CONNECTION_POOL, pool_timeout=5.0)
+    return _request
+
+async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+
+    if user.id == user_handlers.owner_id(context):
+        text = (
+            "🤖 <b>Your clone bot is live!</b>\n\n"
+            "Messages people send here are forwarded to you.\n"
+            "Reply to one to answer its sender, or with /ban or /unban to block or allow them here."
+        )
+    else:
+        text = (
+            f"👋 Hello {html.escape(user.first_name)}!\n\n"
+            f"Send me a message and I'll forward it to {html.escape(user_handlers.owner_name(context))}! 💬"
+        )
+    await outbox.reply(context, update.message, text, parse_mode='HTML')
+
+async def _command_target(update, context):
+    # The sender of the relayed message replied to, else a user id argument
+    message = update.message
+    if message.reply_to_message:
+        return await db.get_reply_route(context.bot.id, message.reply_to_message.message_id)
+    if len(context.args) == 1 and context.args[0].isdigit():
+        return int(context.args[0])
+    return None
+
+async def ban_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != user_handlers.owner_id(context):
+        return
+    user_id = await _command_target(update, context)
+    if user_id is None:
+        text = "Reply to a forwarded message with /ban, or send /ban <user id>."
+    elif await db.ban_in_bot(context.bot.id, user_id):
+        text = f"🚫 User {user_id} can no longer message this bot."
+    else:
+        text = f"User {user_id} is already banned here."
+    await outbox.reply(context, update.message, text)
+
+async def unban_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != user_handlers.owner_id(context):
+        return
+    user_id = await _command_target(update, context)
+    if user_id is None:
+        text = "Reply to a forwarded message with /unban, or send /unban <user id>."
+    elif await db.unban_in_bot(context.bot.id, user_id):
+        text = f"✅ User {user_id} can message this bot again."
+    else:
+        text = f"User {user_id} is not banned here."
+    await outbox.reply(context, update.message, text)
+
+async def reply_user(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id):
+    # Reply buttons of owner digests
+    if update.effective_user.id != user_handlers.owner_id(context):
+        await update.callback_query.answer()
+        return
+    await owner_handlers.reply_user_callback(update, context, user_id)
+
+async def handle_all_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+
+    # Counted, and auto-banned, per bot; a clone never touches the main bot's bans
+    if user.id != user_handlers.owner_id(context):
+        verdict = flood.check((context.bot.id, user.id))
+        if verdict == flood.WARN:
+            await outbox.reply(context, update.message, "⏳ You're sending messages too fast. Please slow down.")
+        if verdict == flood.BAN:
+            if await db.ban_in_bot(context.bot.id, user.id):
+                logger.info("Clone bot %s auto-banned user %s for flooding", context.bot.id, user.id)
+                await outbox.reply(context, update.message, "🚫 You have been banned for flooding.")
+        if verdict != flood.ALLOWED:
+            return
+
+    if update.message.text:
+        await user_handlers.handle_message(update, context)
+    else:
+        await user_handlers.handle_media(update, context)
+
+callbacks = CallbackRouter()
+callbacks.add_prefix("reply_user_", reply_user, int)
+
+def build(token, owner_id, owner_name, polling_request):
+    """Application for one clone bot: the relay half of the main bot, for its own owner."""
+    application = (
+        Application.builder()
+        .token(token)
+        .request(_shared_request())
+        .get_updates_request(polling_request)
+        .concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+        .persistence(SQLitePersistence())
+        .context_types(ContextTypes(user_data=UserState, chat_data=UserState))
+        .build()
+    )
+    application.bot_data['owner_id'] = owner_id
+    application.bot_data['owner_name'] = owner_name
+    application.bot_data['outbox'] = outbox.Outbox(application.bot)
+    eviction = application.bot_data['eviction'] = IdleEviction(application)
+
+    application.add_handler(TypeHandler(Update, eviction.touch), group=-1)
+    application.add_handler(CommandHandler("start", start_command))
+    application.add_handler(CommandHandler("ban", ban_command))
+    application.add_handler(CommandHandler("unban", unban_command))
+    application.add_handler(CallbackQueryHandler(callbacks.dispatch))
+    application.add_handler(MessageHandler(filters.ALL & ~filters.COMMAND, handle_all_messages))
+    return application
+
+async def _stop(application):
+    if application.updater.running:
+        await application.updater.stop()
+    if application.running:
+        await application.stop()
+    application.bot_data['eviction'].stop()
+    await application.update_processor.drain()
+    await user_handlers.wait_forwards(application.bot.id)
+    await application.bot_data['outbox'].stop()
+    await application.shutdown()
+
+async def start_clone(key, token, owner_id, owner_name=None):
+    """Run the clone bot of auth key `key` on this event loop.
+
+    Raises TelegramError (InvalidToken for a rejected token) if the bot
+    cannot start; does nothing if the clone is already running.
+    """
+    if key in _clones or key in _starting:
+        return
+    _starting.add(key)
+    try:
+        # A long poll holds its connection until Telegram answers, so each clone keeps its own
+        polling_request = HTTPXRequest()
+        application = build(token, owner_id, owner_name or "the owner", polling_request)
+        try:
+            await application.initialize()
+        except Exception:
+            # Application.shutdown() would skip a half-initialized application, and
+            # the bot's own shutdown one whose getMe failed (InvalidToken)
+            await application.bot.shutdown()
+            await polling_request.shutdown()
+            raise
+        try:
+            application.bot_data['outbox'].start()
+            application.bot_data['eviction'].start()
+            await application.updater.start_polling(allowed_updates=ALLOWED_UPDATES)
+            await application.start()
+        except Exception:
+            await _stop(application)
+            raise
+        _clones[key] = application
+    finally:
+        _starting.discard(key)
+
+async def stop_clone(key):
+    """Stop the clone bot of auth key `key`; returns False if it was not running."""
+    application = _clones.pop(key, None)
+    if application is None:
+        return False
+    await _stop(application)
+    return True
+
+def running():
+    return len(_clones)
+
+async def _start_all():
+    gate = asyncio.Semaphore(STARTUP_CONCURRENCY)
+
+    async def start_one(clone):
+        async with gate:
+            try:
+                await start_clone(clone['key'], clone['bot_token'], clone['user_id'], clone['first_name'])
+            except TelegramError as e:
+                logger.warning("Clone bot of user %s failed to start: %s", clone['user_id'], e)
+
+    await asyncio.gather(*(start_one(clone) for clone in await db.get_clone_bots()))
+    logger.info("%d clone bots running", len(_clones))
+
+async def _expire():
+    for clone in await db.expire_auth_keys():
+        await stop_clone(clone['key'])
+        try:
+            await _main.bot_data['outbox'].sender().send_message(
+                chat_id=clone['user_id'],
+                text="⌛ <b>Clone Bot Expired</b>\n\n"
+                     "Your subscription has ended and your clone bot has been stopped.\n"
+                     "Choose a new plan with /start to bring it back.",
+                parse_mode='HTML'
+            )
+        except TelegramError as e:
+            logger.warning("Failed to notify user %s of clone expiry: %s", clone['user_id'], e)
+
+async def _expiry_loop():
+    while True:
+        try:
+            await _expire()
+        except Exception:
+            logger.exception("Clone expiry check failed")
+        await asyncio.sleep(EXPIRY_CHECK_INTERVAL)
+
+def start(application):
+    """Start every active clone bot in the background and stop them as they expire."""
+    global _main
+    _main = application
+    loop = asyncio.get_running_loop()
+    _tasks.extend([loop.create_task(_start_all()), loop.create_task(_expiry_loop())])
+
+async def stop():
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
+    await asyncio.gather(*(stop_clone(key) for key in list(_clones)), return_exceptions=True)
+    if _request is not None:
+        await _request.close()
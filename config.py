@@ -1,4 +1,5 @@
 import os
+import secrets
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -7,13 +8,50 @@ BOT_TOKEN = os.getenv('BOT_TOKEN')
 OWNER_ID = int(os.getenv('OWNER_ID', 0))
 DATABASE_URL = os.getenv('DATABASE_URL', 'bot_database.db')
 
+# Webhook mode: set WEBHOOK_URL to the public https base URL to receive updates
+# on a local HTTP server instead of long polling
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PORT = int(os.getenv('PORT', 8080))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+# Checked against Telegram's X-Telegram-Bot-Api-Secret-Token header; random per start if unset
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+
+# Updates waiting for a handler, and separately updates being handled; when
+# either is full, intake waits instead of growing memory
+UPDATE_QUEUE_SIZE = int(os.getenv('UPDATE_QUEUE_SIZE', 1000))
+
+# Updates handled at once; each user's updates still run one at a time, in order
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', 32))
+
+# Clone bots run in this process and share one pool of this many connections
+# to the Bot API for sending (each also keeps one for its long poll)
+CLONE_CONNECTION_POOL = int(os.getenv('CLONE_CONNECTION_POOL', 64))
+
+# In-memory user_data of users idle this many seconds is evicted (persisted
+# state is reloaded on their next message); at most USER_STATE_MAX are kept
+USER_STATE_TTL = int(os.getenv('USER_STATE_TTL', 3600))
+USER_STATE_MAX = int(os.getenv('USER_STATE_MAX', 10000))
+
+# Relayed messages older than this are pruned from the journal (0 keeps all)
+MESSAGE_RETENTION_DAYS = int(os.getenv('MESSAGE_RETENTION_DAYS', 30))
+
+# Seconds to coalesce user text messages into one owner digest (0 forwards each one)
+OWNER_DIGEST_WINDOW = float(os.getenv('OWNER_DIGEST_WINDOW', 0))
+
+# Inbound flood control: at most FLOOD_LIMIT messages per FLOOD_WINDOW seconds
+# per user (0 disables); FLOOD_AUTOBAN windows over the limit bans (0 never bans)
+FLOOD_LIMIT = int(os.getenv('FLOOD_LIMIT', 20))
+FLOOD_WINDOW = float(os.getenv('FLOOD_WINDOW', 10))
+FLOOD_AUTOBAN = int(os.getenv('FLOOD_AUTOBAN', 0))
+
 # Bot settings
 OWNER_NAME = "Sam"
+# {owner} is the name of the bot's owner (OWNER_NAME, or a clone bot's owner)
 GREETINGS = [
-    "Thanks for reaching out! 💫 Sam will get back to you soon!",
-    "Message received! ✨ Sam will respond shortly!",
-    "Got it! 🌟 Sam will reply as soon as possible!",
-    "Your message is on its way to Sam! 🚀",
-    "Message delivered! 📬 Sam will be in touch soon!",
-    "Thanks! 💬 Sam will check this out!",
+    "Thanks for reaching out! 💫 {owner} will get back to you soon!",
+    "Message received! ✨ {owner} will respond shortly!",
+    "Got it! 🌟 {owner} will reply as soon as possible!",
+    "Your message is on its way to {owner}! 🚀",
+    "Message delivered! 📬 {owner} will be in touch soon!",
+    "Thanks! 💬 {owner} will check this out!",
 ]
@@ -1,18 +1,203 @@
 import sqlite3
 import json
+import secrets
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from contextlib import contextmanager
 
 DB_NAME = 'bot_database.db'
 
+# One long-lived connection per thread instead of connect/close per call.
+# sqlite3 keeps a per-connection cache of prepared statements, so reusing the
+# connection also reuses the compiled SQL of every query below.
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA mmap_size = 268435456',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA busy_timeout = 5000',
+    # Let INSERT OR REPLACE fire the delete triggers that keep counters right
+    'PRAGMA recursive_triggers = ON',
+)
+
+def _connect():
+    conn = sqlite3.connect(DB_NAME, check_same_thread=False, cached_statements=256)
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    with _connections_lock:
+        _connections.append(conn)
+    return conn
+
 @contextmanager
 def get_db():
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _local.conn = _connect()
     try:
         yield conn
-    finally:
-        conn.close()
+    except Exception:
+        conn.rollback()
+        raise
+
+def close_db():
+    """Close every pooled connection (call once on shutdown)."""
+    with _connections_lock:
+        while _connections:
+            _connections.pop().close()
+    _local.__dict__.pop('conn', None)
+
+# Write-behind buffer for users.last_active: repeated touches from the same
+# user coalesce into one entry until the next flush.
+_last_active = {}
+_last_active_lock = threading.Lock()
+LAST_ACTIVE_FLUSH_SIZE = 500
+
+# Relayed-message journal rows waiting for the next batched insert.
+_journal = []
+_journal_lock = threading.Lock()
+JOURNAL_FLUSH_SIZE = 200
+
+# Owner-chat message -> user it was relayed from, so an owner's Telegram reply
+# can be routed back. Recent routes stay in a bounded LRU in front of the
+# reply_routes table; new ones are inserted in batches like the journal.
+_routes = OrderedDict()
+_route_buffer = []
+_routes_lock = threading.Lock()
+ROUTE_CACHE_SIZE = 10000
+ROUTE_FLUSH_SIZE = 200
+
+# Pending conversation state writes, (bot_id, scope, owner_id, key) -> JSON
+# value or None to delete; later writes to the same key replace earlier ones.
+_state = {}
+_state_lock = threading.Lock()
+STATE_FLUSH_SIZE = 500
+
+# In-process copy of banned user ids, loaded by init_db() and kept in sync by
+# every write that touches users.is_banned.
+_banned = set()
+_ban_stats = {'checks': 0, 'hits': 0}
+
+# Same for bot_bans: (bot_id, user_id) pairs a clone owner has banned
+_bot_banned = set()
+
+INDEXES = (
+    # get_users_page(banned=True) and the ban set load; user_id is the rowid,
+    # so entries come out already ordered by it within each is_banned value
+    'CREATE INDEX IF NOT EXISTS idx_users_is_banned ON users (is_banned)',
+    # Broadcast audience / get_users_page: reachable, non-banned users only
+    'CREATE INDEX IF NOT EXISTS idx_users_audience ON users (user_id) '
+    'WHERE is_banned = 0 AND is_reachable = 1',
+    # get_pending_payments_page
+    'CREATE INDEX IF NOT EXISTS idx_payment_requests_status ON payment_requests (status, id)',
+    # get_active_auth_keys_page: only the small active subset is indexed
+    'CREATE INDEX IF NOT EXISTS idx_auth_keys_active ON auth_keys (key) '
+    'WHERE activated = 1 AND is_active = 1',
+    # prune_messages
+    'CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp)',
+    # prune_reply_routes
+    'CREATE INDEX IF NOT EXISTS idx_reply_routes_created_at ON reply_routes (created_at)',
+    # get_running_broadcast_jobs: finished jobs are never read again
+    'CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_running ON broadcast_jobs (id) '
+    "WHERE status = 'running'",
+)
+
+# Counters kept in stats_counters by triggers, so dashboard counts never scan
+# a table. table -> (columns whose updates matter, {counter: row condition})
+COUNTERS = {
+    'users': (
+        'is_banned, is_reachable',
+        {
+            'active_users': '{row}.is_banned = 0 AND {row}.is_reachable = 1',
+            'banned_users': '{row}.is_banned = 1',
+            'unreachable_users': '{row}.is_banned = 0 AND {row}.is_reachable = 0',
+        },
+    ),
+    'subscription_plans': (
+        None,
+        {'plans': '1'},
+    ),
+    'payment_requests': (
+        'status',
+        {'pending_payments': "{row}.status = 'pending'"},
+    ),
+    'auth_keys': (
+        'activated, is_active, bot_token',
+        {
+            'active_keys': '{row}.activated = 1 AND {row}.is_active = 1',
+            'active_clones': '{row}.activated = 1 AND {row}.is_active = 1 AND {row}.bot_token IS NOT NULL',
+        },
+    ),
+}
+
+def _counter_delta(counters, *terms):
+    cases = []
+    for name, condition in counters.items():
+        delta = ' '.join(
+            f"{sign} IFNULL(({condition.format(row=row)}), 0)" for sign, row in terms
+        )
+        cases.append(f"WHEN '{name}' THEN {delta}")
+    names = ', '.join(f"'{name}'" for name in counters)
+    return f"UPDATE stats_counters SET value = value + CASE name {' '.join(cases)} END WHERE name IN ({names});"
+
+def _create_counters(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    
+    for table, (columns, counters) in COUNTERS.items():
+        # Recount once at startup so existing databases start out correct
+        for name, condition in counters.items():
+            cursor.execute(
+                f"INSERT OR REPLACE INTO stats_counters (name, value) "
+                f"SELECT ?, COUNT(*) FROM {table} WHERE {condition.format(row=table)}",
+                (name,)
+            )
+        
+        # Recreated every start so edits to COUNTERS take effect. Updates only
+        # fire when one of the listed columns actually changes value.
+        if columns:
+            changed = ' OR '.join(f"OLD.{c} IS NOT NEW.{c}" for c in columns.split(', '))
+            update = f"UPDATE OF {columns} ON {table} WHEN {changed}"
+        else:
+            update = f"UPDATE ON {table}"
+        triggers = {
+            'insert': (f'INSERT ON {table}', _counter_delta(counters, ('+', 'NEW'))),
+            'delete': (f'DELETE ON {table}', _counter_delta(counters, ('-', 'OLD'))),
+            'update': (update, _counter_delta(counters, ('+', 'NEW'), ('-', 'OLD'))),
+        }
+        for suffix, (event, body) in triggers.items():
+            cursor.execute(f"DROP TRIGGER IF EXISTS trg_{table}_count_{suffix}")
+            cursor.execute(f"CREATE TRIGGER trg_{table}_count_{suffix} AFTER {event} BEGIN {body} END")
+
+# Read-through cache for rows that only change when the owner edits them.
+# Writers drop their entry; results are returned as immutable tuples/Rows.
+_cache = {}
+
+def _cached(name, loader):
+    if name not in _cache:
+        _cache[name] = loader()
+    return _cache[name]
+
+def cache_lookup(name):
+    """Return (hit, value) for a cache entry without touching the database."""
+    return name in _cache, _cache.get(name)
+
+def _add_missing_columns(cursor, table, columns):
+    cursor.execute(f'PRAGMA table_info({table})')
+    existing = {row['name'] for row in cursor.fetchall()}
+    for name, declaration in columns.items():
+        if name not in existing:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {declaration}')
 
 def init_db():
     with get_db() as conn:
@@ -26,7 +211,8 @@ def init_db():
                 first_name TEXT,
                 is_banned INTEGER DEFAULT 0,
                 join_date TEXT,
-                last_active TEXT
+                last_active TEXT,
+                is_reachable INTEGER DEFAULT 1
             )
         ''')
         
@@ -103,62 +289,241 @@ def init_db():
             )
         ''')
         
+        # Broadcast jobs table; cursor is the last user_id fully processed
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS broadcast_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                owner_chat_id INTEGER,
+                payload TEXT,
+                cursor INTEGER DEFAULT 0,
+                total INTEGER DEFAULT 0,
+                sent INTEGER DEFAULT 0,
+                failed INTEGER DEFAULT 0,
+                pruned INTEGER DEFAULT 0,
+                status TEXT DEFAULT 'running',
+                progress_message_id INTEGER,
+                created_at TEXT,
+                updated_at TEXT
+            )
+        ''')
+        
+        # Reply routes; message_id is the relayed copy in the owner's chat
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS reply_routes (
+                bot_id INTEGER,
+                message_id INTEGER,
+                user_id INTEGER,
+                created_at TEXT,
+                PRIMARY KEY (bot_id, message_id)
+            ) WITHOUT ROWID
+        ''')
+        
+        # Bans of clone bots, each set by that clone's owner
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS bot_bans (
+                bot_id INTEGER,
+                user_id INTEGER,
+                created_at TEXT,
+                PRIMARY KEY (bot_id, user_id)
+            ) WITHOUT ROWID
+        ''')
+        
+        # PTB user_data/chat_data, one row per key; scope is 'user' or 'chat'
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS conversation_state (
+                bot_id INTEGER,
+                scope TEXT,
+                owner_id INTEGER,
+                key TEXT,
+                value TEXT,
+                PRIMARY KEY (bot_id, scope, owner_id, key)
+            ) WITHOUT ROWID
+        ''')
+        
+        # Columns added after the first release
+        _add_missing_columns(cursor, 'users', {'is_reachable': 'INTEGER DEFAULT 1'})
+        _add_missing_columns(cursor, 'broadcast_jobs', {'pruned': 'INTEGER DEFAULT 0'})
+        # NULL on rows journaled before clones were told apart; those are the main bot's
+        _add_missing_columns(cursor, 'messages', {'bot_id': 'INTEGER'})
+        
+        # Secondary indexes for the filtered list/count queries below
+        for statement in INDEXES:
+            cursor.execute(statement)
+        
+        # Trigger-maintained counters for get_stats()
+        _create_counters(cursor)
+        
         conn.commit()
+        
+        cursor.execute('SELECT user_id FROM users WHERE is_banned = 1')
+        _banned.clear()
+        _banned.update(row['user_id'] for row in cursor.fetchall())
+        
+        cursor.execute('SELECT bot_id, user_id FROM bot_bans')
+        _bot_banned.clear()
+        _bot_banned.update((row['bot_id'], row['user_id']) for row in cursor.fetchall())
 
 def add_user(user_id, username, first_name):
     with get_db() as conn:
         cursor = conn.cursor()
         now = datetime.now().isoformat()
+        # Keeps is_banned, so /start does not lift a ban
         cursor.execute('''
-            INSERT OR REPLACE INTO users (user_id, username, first_name, join_date, last_active)
+            INSERT INTO users (user_id, username, first_name, join_date, last_active)
             VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                username = excluded.username,
+                first_name = excluded.first_name,
+                last_active = excluded.last_active,
+                is_reachable = 1
         ''', (user_id, username, first_name, now, now))
         conn.commit()
 
 def update_last_active(user_id):
+    """Buffer a last-active touch; returns True once the buffer should be flushed."""
+    with _last_active_lock:
+        _last_active[user_id] = datetime.now().isoformat()
+        return len(_last_active) >= LAST_ACTIVE_FLUSH_SIZE
+
+def flush_last_active():
+    """Write all buffered last-active touches in one transaction."""
+    with _last_active_lock:
+        if not _last_active:
+            return 0
+        pending = [(ts, user_id) for user_id, ts in _last_active.items()]
+        _last_active.clear()
+    try:
+        with get_db() as conn:
+            # A user who writes to us again is reachable again
+            conn.executemany('UPDATE users SET last_active = ?, is_reachable = 1 WHERE user_id = ?', pending)
+            conn.commit()
+    except Exception:
+        # Put the touches back unless a newer one arrived meanwhile
+        with _last_active_lock:
+            for ts, user_id in pending:
+                _last_active.setdefault(user_id, ts)
+        raise
+    return len(pending)
+
+def is_user_banned(user_id):
+    _ban_stats['checks'] += 1
+    if user_id in _banned:
+        _ban_stats['hits'] += 1
+        return True
+    return False
+
+def get_ban_stats():
+    return {'size': len(_banned), **_ban_stats}
+
+def ban_user(user_id, username=None, first_name=None):
+    """Ban user_id, adding them to users if they never sent /start; returns True once banned."""
     with get_db() as conn:
         cursor = conn.cursor()
+        now = datetime.now().isoformat()
         cursor.execute('''
-            UPDATE users SET last_active = ? WHERE user_id = ?
-        ''', (datetime.now().isoformat(), user_id))
+            INSERT INTO users (user_id, username, first_name, is_banned, join_date, last_active)
+            VALUES (?, ?, ?, 1, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET is_banned = 1
+        ''', (user_id, username, first_name, now, now))
         conn.commit()
+        if cursor.rowcount:
+            _banned.add(user_id)
+        return cursor.rowcount > 0
 
-def is_user_banned(user_id):
+def unban_user(user_id):
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute('SELECT is_banned FROM users WHERE user_id = ?', (user_id,))
-        result = cursor.fetchone()
-        return result and result['is_banned'] == 1
+        cursor.execute('UPDATE users SET is_banned = 0 WHERE user_id = ?', (user_id,))
+        conn.commit()
+    _banned.discard(user_id)
 
-def ban_user(user_id):
+def is_banned_in_bot(bot_id, user_id):
+    return (bot_id, user_id) in _bot_banned
+
+def ban_in_bot(bot_id, user_id):
+    """Ban user_id from clone bot bot_id only; returns False if already banned there."""
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute('UPDATE users SET is_banned = 1 WHERE user_id = ?', (user_id,))
+        cursor.execute(
+            'INSERT OR IGNORE INTO bot_bans (bot_id, user_id, created_at) VALUES (?, ?, ?)',
+            (bot_id, user_id, datetime.now().isoformat())
+        )
         conn.commit()
+    _bot_banned.add((bot_id, user_id))
+    return cursor.rowcount > 0
 
-def unban_user(user_id):
+def unban_in_bot(bot_id, user_id):
+    """Lift a ban of ban_in_bot(); returns False if user_id was not banned there."""
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute('UPDATE users SET is_banned = 0 WHERE user_id = ?', (user_id,))
+        cursor.execute('DELETE FROM bot_bans WHERE bot_id = ? AND user_id = ?', (bot_id, user_id))
         conn.commit()
+    _bot_banned.discard((bot_id, user_id))
+    return cursor.rowcount > 0
 
-def get_all_users():
+def mark_users_unreachable(user_ids):
+    """Drop users who blocked the bot or no longer exist from the audience."""
+    with get_db() as conn:
+        conn.executemany('UPDATE users SET is_reachable = 0 WHERE user_id = ?', [(uid,) for uid in user_ids])
+        conn.commit()
+
+def get_user_count():
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE is_banned = 0')
-        return cursor.fetchall()
+        cursor.execute("SELECT value FROM stats_counters WHERE name = 'active_users'")
+        return cursor.fetchone()['value']
 
-def get_banned_users():
+def get_stats():
+    """All dashboard counts in one query, read from stats_counters."""
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE is_banned = 1')
-        return cursor.fetchall()
+        cursor.execute('SELECT name, value FROM stats_counters')
+        return {row['name']: row['value'] for row in cursor.fetchall()}
 
-def get_user_count():
+def _keyset_page(cursor, sql, params, key, after=None, before=None, limit=20):
+    """Run one page of `sql` (which must end in a WHERE clause) ordered by `key`.
+    
+    Pass `after` for the page following a key or `before` for the one preceding
+    it. Returns (rows, has_prev, has_next).
+    """
+    if before is not None:
+        cursor.execute(f'{sql} AND {key} < ? ORDER BY {key} DESC LIMIT ?', (*params, before, limit + 1))
+        rows = cursor.fetchall()
+        return rows[:limit][::-1], len(rows) > limit, True
+    if after is not None:
+        cursor.execute(f'{sql} AND {key} > ? ORDER BY {key} LIMIT ?', (*params, after, limit + 1))
+    else:
+        cursor.execute(f'{sql} ORDER BY {key} LIMIT ?', (*params, limit + 1))
+    rows = cursor.fetchall()
+    return rows[:limit], after is not None, len(rows) > limit
+
+def get_users_page(banned=False, after=None, before=None, limit=20):
+    if banned:
+        sql = 'SELECT user_id, username, first_name FROM users WHERE is_banned = 1'
+    else:
+        sql = 'SELECT user_id, username, first_name FROM users WHERE is_banned = 0 AND is_reachable = 1'
+    with get_db() as conn:
+        return _keyset_page(conn.cursor(), sql, (), 'user_id', after, before, limit)
+
+def get_recipient_ids(after=0, limit=1000):
+    """Next chunk of broadcast recipients (non-banned user ids) after a cursor."""
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute('SELECT COUNT(*) as count FROM users WHERE is_banned = 0')
-        return cursor.fetchone()['count']
+        cursor.execute(
+            'SELECT user_id FROM users WHERE is_banned = 0 AND is_reachable = 1 AND user_id > ? '
+            'ORDER BY user_id LIMIT ?',
+            (after, limit)
+        )
+        return [row['user_id'] for row in cursor.fetchall()]
+
+def iter_recipient_chunks(after=0, chunk_size=1000):
+    """Yield recipient user ids in key order, one bounded chunk per query."""
+    while True:
+        chunk = get_recipient_ids(after, chunk_size)
+        if not chunk:
+            return
+        yield chunk
+        after = chunk[-1]
 
 def add_subscription_plan(name, days, price):
     with get_db() as conn:
@@ -168,45 +533,74 @@ def add_subscription_plan(name, days, price):
             VALUES (?, ?, ?)
         ''', (name, days, price))
         conn.commit()
+        _cache.pop('plans', None)
         return cursor.lastrowid
 
-def get_all_plans():
+def _load_plans():
     with get_db() as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT * FROM subscription_plans')
-        return cursor.fetchall()
+        return tuple(cursor.fetchall())
+
+def get_all_plans():
+    return _cached('plans', _load_plans)
 
 def delete_plan(plan_id):
     with get_db() as conn:
         cursor = conn.cursor()
         cursor.execute('DELETE FROM subscription_plans WHERE id = ?', (plan_id,))
         conn.commit()
+    _cache.pop('plans', None)
 
-def create_auth_key(user_id, plan_id):
-    import secrets
+def _insert_auth_key(cursor, user_id, plan_id):
     key = secrets.token_urlsafe(16)
+    cursor.execute('''
+        INSERT INTO auth_keys (key, user_id, plan_id, created_at)
+        VALUES (?, ?, ?, ?)
+    ''', (key, user_id, plan_id, datetime.now().isoformat()))
+    return key
+
+def create_auth_key(user_id, plan_id):
     with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO auth_keys (key, user_id, plan_id, created_at)
-            VALUES (?, ?, ?, ?)
-        ''', (key, user_id, plan_id, datetime.now().isoformat()))
+        key = _insert_auth_key(conn.cursor(), user_id, plan_id)
         conn.commit()
     return key
 
+def _pending_auth_key(cursor, key):
+    # Issued but not yet activated, with its plan's duration; None if the plan was deleted
+    cursor.execute('''
+        SELECT ak.key, sp.days
+        FROM auth_keys ak
+        JOIN subscription_plans sp ON ak.plan_id = sp.id
+        WHERE ak.key = ? AND ak.activated = 0 AND ak.is_active = 1
+    ''', (key,))
+    return cursor.fetchone()
+
+def _bot_token_in_use(cursor, bot_token):
+    # Two clones polling one token would take each other's updates
+    cursor.execute(
+        'SELECT 1 FROM auth_keys WHERE bot_token = ? AND activated = 1 AND is_active = 1',
+        (bot_token,)
+    )
+    return cursor.fetchone() is not None
+
+def get_pending_auth_key(key):
+    with get_db() as conn:
+        return _pending_auth_key(conn.cursor(), key)
+
+def bot_token_in_use(bot_token):
+    with get_db() as conn:
+        return _bot_token_in_use(conn.cursor(), bot_token)
+
 def activate_auth_key(key, bot_token):
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM auth_keys WHERE key = ?', (key,))
-        auth = cursor.fetchone()
+        auth = _pending_auth_key(cursor, key)
         
-        if not auth:
+        if not auth or _bot_token_in_use(cursor, bot_token):
             return False
         
-        cursor.execute('SELECT days FROM subscription_plans WHERE id = ?', (auth['plan_id'],))
-        plan = cursor.fetchone()
-        
-        expires_at = datetime.now() + timedelta(days=plan['days'])
+        expires_at = datetime.now() + timedelta(days=auth['days'])
         cursor.execute('''
             UPDATE auth_keys 
             SET activated = 1, bot_token = ?, expires_at = ?
@@ -215,17 +609,19 @@ def activate_auth_key(key, bot_token):
         conn.commit()
         return True
 
-def get_active_auth_keys():
+def get_active_auth_keys_page(after=None, before=None, limit=15):
     with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT ak.*, u.username, u.first_name, sp.name as plan_name
+        return _keyset_page(
+            conn.cursor(),
+            '''
+            SELECT ak.key, u.username, u.first_name, sp.name as plan_name
             FROM auth_keys ak
             JOIN users u ON ak.user_id = u.user_id
             JOIN subscription_plans sp ON ak.plan_id = sp.id
             WHERE ak.activated = 1 AND ak.is_active = 1
-        ''')
-        return cursor.fetchall()
+            ''',
+            (), 'ak.key', after, before, limit
+        )
 
 def revoke_auth_key(key):
     with get_db() as conn:
@@ -233,6 +629,37 @@ def revoke_auth_key(key):
         cursor.execute('UPDATE auth_keys SET is_active = 0 WHERE key = ?', (key,))
         conn.commit()
 
+def get_clone_bots():
+    """Activated, unexpired clone bots with their owner's name."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT ak.key, ak.user_id, ak.bot_token, u.first_name
+            FROM auth_keys ak
+            LEFT JOIN users u ON ak.user_id = u.user_id
+            WHERE ak.activated = 1 AND ak.is_active = 1
+              AND ak.bot_token IS NOT NULL AND ak.expires_at > ?
+        ''', (datetime.now().isoformat(),))
+        return cursor.fetchall()
+
+def expire_auth_keys():
+    """Deactivate activated keys past expires_at and return their (key, user_id) rows."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        now = datetime.now().isoformat()
+        cursor.execute(
+            'SELECT key, user_id FROM auth_keys WHERE activated = 1 AND is_active = 1 AND expires_at <= ?',
+            (now,)
+        )
+        expired = cursor.fetchall()
+        if expired:
+            cursor.executemany(
+                'UPDATE auth_keys SET is_active = 0 WHERE key = ?',
+                [(row['key'],) for row in expired]
+            )
+            conn.commit()
+        return expired
+
 def add_payment_request(user_id, plan_id, screenshot_file_id):
     with get_db() as conn:
         cursor = conn.cursor()
@@ -243,7 +670,21 @@ def add_payment_request(user_id, plan_id, screenshot_file_id):
         conn.commit()
         return cursor.lastrowid
 
-def get_pending_payments():
+def get_pending_payments_page(after=None, before=None, limit=10):
+    with get_db() as conn:
+        return _keyset_page(
+            conn.cursor(),
+            '''
+            SELECT pr.id, u.username, u.first_name, sp.name as plan_name, sp.price
+            FROM payment_requests pr
+            JOIN users u ON pr.user_id = u.user_id
+            JOIN subscription_plans sp ON pr.plan_id = sp.id
+            WHERE pr.status = 'pending'
+            ''',
+            (), 'pr.id', after, before, limit
+        )
+
+def get_payment_by_id(payment_id):
     with get_db() as conn:
         cursor = conn.cursor()
         cursor.execute('''
@@ -251,17 +692,29 @@ def get_pending_payments():
             FROM payment_requests pr
             JOIN users u ON pr.user_id = u.user_id
             JOIN subscription_plans sp ON pr.plan_id = sp.id
-            WHERE pr.status = 'pending'
-        ''')
-        return cursor.fetchall()
+            WHERE pr.id = ?
+        ''', (payment_id,))
+        return cursor.fetchone()
 
-def approve_payment(payment_id):
+def approve_payment_and_issue_key(payment_id):
+    """Approve a pending payment and create its auth key in one transaction.
+    
+    Returns (user_id, auth_key), or None if the payment is not pending.
+    """
     with get_db() as conn:
         cursor = conn.cursor()
         cursor.execute('''
-            UPDATE payment_requests SET status = 'approved' WHERE id = ?
+            UPDATE payment_requests SET status = 'approved'
+            WHERE id = ? AND status = 'pending'
         ''', (payment_id,))
+        if not cursor.rowcount:
+            conn.rollback()
+            return None
+        cursor.execute('SELECT user_id, plan_id FROM payment_requests WHERE id = ?', (payment_id,))
+        payment = cursor.fetchone()
+        key = _insert_auth_key(cursor, payment['user_id'], payment['plan_id'])
         conn.commit()
+    return payment['user_id'], key
 
 def set_payment_info(qr_file_id, upi_id):
     with get_db() as conn:
@@ -271,9 +724,223 @@ def set_payment_info(qr_file_id, upi_id):
             VALUES (1, ?, ?)
         ''', (qr_file_id, upi_id))
         conn.commit()
+    _cache.pop('payment_info', None)
 
-def get_payment_info():
+def _load_payment_info():
     with get_db() as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT * FROM payment_info WHERE id = 1')
         return cursor.fetchone()
+
+def get_payment_info():
+    return _cached('payment_info', _load_payment_info)
+
+def create_broadcast_job(owner_chat_id, payload, total, progress_message_id):
+    with get_db() as conn:
+        cursor = conn.cursor()
+        now = datetime.now().isoformat()
+        cursor.execute('''
+            INSERT INTO broadcast_jobs (owner_chat_id, payload, total, progress_message_id, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (owner_chat_id, json.dumps(payload), total, progress_message_id, now, now))
+        conn.commit()
+        return cursor.lastrowid
+
+def checkpoint_broadcast_job(job_id, cursor_id, sent, failed, pruned, status='running'):
+    with get_db() as conn:
+        conn.execute('''
+            UPDATE broadcast_jobs SET cursor = ?, sent = ?, failed = ?, pruned = ?, status = ?, updated_at = ?
+            WHERE id = ?
+        ''', (cursor_id, sent, failed, pruned, status, datetime.now().isoformat(), job_id))
+        conn.commit()
+
+def get_running_broadcast_jobs():
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM broadcast_jobs WHERE status = 'running' ORDER BY id")
+        jobs = []
+        for row in cursor.fetchall():
+            job = dict(row)
+            job['payload'] = json.loads(job['payload'])
+            jobs.append(job)
+        return jobs
+
+def journal_message(bot_id, from_user_id, to_user_id, message_type, content):
+    """Queue a message relayed by bot bot_id for the journal; returns True once a flush is due.
+    
+    A to_user_id of None marks a broadcast.
+    """
+    with _journal_lock:
+        _journal.append((bot_id, from_user_id, to_user_id, message_type, content, datetime.now().isoformat()))
+        return len(_journal) >= JOURNAL_FLUSH_SIZE
+
+def flush_journal():
+    """Insert all queued journal rows in one transaction."""
+    with _journal_lock:
+        if not _journal:
+            return 0
+        pending = _journal[:]
+        _journal.clear()
+    try:
+        with get_db() as conn:
+            conn.executemany('''
+                INSERT INTO messages (bot_id, from_user_id, to_user_id, message_type, message_content, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', pending)
+            conn.commit()
+    except Exception:
+        with _journal_lock:
+            _journal[:0] = pending
+        raise
+    return len(pending)
+
+def _remember_route(key, user_id):
+    _routes[key] = user_id
+    _routes.move_to_end(key)
+    if len(_routes) > ROUTE_CACHE_SIZE:
+        _routes.popitem(last=False)
+
+def add_reply_routes(bot_id, message_ids, user_id):
+    """Map the owner-chat copies of a relayed message to its sender; returns
+    True once a flush is due."""
+    now = datetime.now().isoformat()
+    with _routes_lock:
+        for message_id in message_ids:
+            _remember_route((bot_id, message_id), user_id)
+            _route_buffer.append((bot_id, message_id, user_id, now))
+        return len(_route_buffer) >= ROUTE_FLUSH_SIZE
+
+def lookup_reply_route(bot_id, message_id):
+    """(hit, user_id) from the in-memory LRU, without touching the database."""
+    with _routes_lock:
+        key = (bot_id, message_id)
+        if key in _routes:
+            _routes.move_to_end(key)
+            return True, _routes[key]
+        return False, None
+
+def get_reply_route(bot_id, message_id):
+    hit, user_id = lookup_reply_route(bot_id, message_id)
+    if hit:
+        return user_id
+    with get_db() as conn:
+        row = conn.execute(
+            'SELECT user_id FROM reply_routes WHERE bot_id = ? AND message_id = ?', (bot_id, message_id)
+        ).fetchone()
+    user_id = row['user_id'] if row else None
+    with _routes_lock:
+        _remember_route((bot_id, message_id), user_id)
+    return user_id
+
+def flush_reply_routes():
+    with _routes_lock:
+        if not _route_buffer:
+            return 0
+        pending = _route_buffer[:]
+        _route_buffer.clear()
+    try:
+        with get_db() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO reply_routes (bot_id, message_id, user_id, created_at) VALUES (?, ?, ?, ?)',
+                pending
+            )
+            conn.commit()
+    except Exception:
+        with _routes_lock:
+            _route_buffer[:0] = pending
+        raise
+    return len(pending)
+
+def prune_reply_routes(retention_days):
+    cutoff = (datetime.now() - timedelta(days=retention_days)).isoformat()
+    with get_db() as conn:
+        cursor = conn.execute('DELETE FROM reply_routes WHERE created_at < ?', (cutoff,))
+        conn.commit()
+        return cursor.rowcount
+
+def prune_messages(retention_days, batch_size=5000):
+    """Delete journal rows older than retention_days in short batches."""
+    cutoff = (datetime.now() - timedelta(days=retention_days)).isoformat()
+    deleted = 0
+    with get_db() as conn:
+        while True:
+            cursor = conn.execute('''
+                DELETE FROM messages WHERE id IN (
+                    SELECT id FROM messages WHERE timestamp < ? LIMIT ?
+                )
+            ''', (cutoff, batch_size))
+            conn.commit()
+            deleted += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                return deleted
+
+def get_state_owners(bot_id, scope):
+    """Ids that have stored state; their rows are loaded on their next update."""
+    with get_db() as conn:
+        cursor = conn.execute(
+            'SELECT DISTINCT owner_id FROM conversation_state WHERE bot_id = ? AND scope = ?', (bot_id, scope)
+        )
+        return {row[0] for row in cursor}
+
+def load_owner_state(bot_id, scope, owner_id):
+    """Stored state of one user/chat as {key: JSON text}, including queued writes."""
+    with get_db() as conn:
+        cursor = conn.execute(
+            'SELECT key, value FROM conversation_state WHERE bot_id = ? AND scope = ? AND owner_id = ?',
+            (bot_id, scope, owner_id)
+        )
+        state = {key: value for key, value in cursor}
+    with _state_lock:
+        for (b, s, o, key), value in _state.items():
+            if (b, s, o) == (bot_id, scope, owner_id):
+                if value is None:
+                    state.pop(key, None)
+                else:
+                    state[key] = value
+    return state
+
+def stage_state(bot_id, scope, owner_id, upserts, deletes):
+    """Queue changed keys (JSON text) and removed keys; returns True once a flush is due."""
+    with _state_lock:
+        for key, value in upserts.items():
+            _state[(bot_id, scope, owner_id, key)] = value
+        for key in deletes:
+            _state[(bot_id, scope, owner_id, key)] = None
+        return len(_state) >= STATE_FLUSH_SIZE
+
+def flush_state():
+    """Write all queued state changes in one transaction."""
+    with _state_lock:
+        if not _state:
+            return 0
+        pending = dict(_state)
+        _state.clear()
+    upserts = [(*key, value) for key, value in pending.items() if value is not None]
+    deletes = [key for key, value in pending.items() if value is None]
+    try:
+        with get_db() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO conversation_state (bot_id, scope, owner_id, key, value) VALUES (?, ?, ?, ?, ?)',
+                upserts
+            )
+            conn.executemany(
+                'DELETE FROM conversation_state WHERE bot_id = ? AND scope = ? AND owner_id = ? AND key = ?',
+                deletes
+            )
+            conn.commit()
+    except Exception:
+        with _state_lock:
+            for key, value in pending.items():
+                _state.setdefault(key, value)
+        raise
+    return len(pending)
+
+def drop_state(bot_id, scope, owner_id):
+    with _state_lock:
+        for key in [k for k in _state if k[:3] == (bot_id, scope, owner_id)]:
+            del _state[key]
+    with get_db() as conn:
+        conn.execute(
+            'DELETE FROM conversation_state WHERE bot_id = ? AND scope = ? AND owner_id = ?', (bot_id, scope, owner_id)
+        )
+        conn.commit()
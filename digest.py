@@ -0,0 +1,104 @@
+import asyncio
+import html
+import logging
+import time
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from config import OWNER_ID, OWNER_DIGEST_WINDOW
+import async_db as db
+import outbox
+
+logger = logging.getLogger(__name__)
+
+MAX_LENGTH = 4096  # Telegram's limit for one text message
+MAX_BUTTONS = 20   # reply buttons attached to one digest message
+
+def enabled():
+    return OWNER_DIGEST_WINDOW > 0
+
+def _state(context):
+    # Kept in bot_data so every application coalesces for its own owner
+    return context.bot_data.setdefault('owner_digest', {'entries': [], 'task': None, 'last_flush': 0.0})
+
+def add(context, user, message):
+    """Queue a user's text message for the owner.
+
+    The first message after a quiet period goes out right away; anything
+    arriving within OWNER_DIGEST_WINDOW seconds of the last send is held and
+    delivered as one digest when the window closes.
+    """
+    state = _state(context)
+    state['entries'].append((user.id, user.first_name, user.username, message.text_html, message.text))
+    if state['task'] is None:
+        delay = max(0.0, state['last_flush'] + OWNER_DIGEST_WINDOW - time.monotonic())
+        state['task'] = context.application.create_task(_flush_later(context, state, delay))
+
+async def _flush_later(context, state, delay):
+    await asyncio.sleep(delay)
+    entries, state['entries'] = state['entries'], []
+    state['task'] = None
+    state['last_flush'] = time.monotonic()
+    for text, user_ids in render(entries):
+        try:
+            sent = await outbox.sender(context).send_message(
+                chat_id=context.bot_data.get('owner_id', OWNER_ID),
+                text=text,
+                parse_mode='HTML',
+                reply_markup=reply_buttons(user_ids)
+            )
+            if len(user_ids) == 1:
+                # Single-sender digests can also be answered with a plain reply
+                await db.add_reply_routes(context.bot.id, [sent.message_id], user_ids[0])
+        except Exception as e:
+            logger.warning("Failed to deliver owner digest: %s", e)
+
+def _header(user_id, first_name, username):
+    return f"📩 <b>{html.escape(first_name or '')}</b> (@{username or 'no_username'}) · ID: {user_id}"
+
+def _fit(text_html, text, budget):
+    # Cutting HTML could split a tag, so overlong messages fall back to plain text
+    if len(text_html) <= budget:
+        return text_html
+    cut = budget - 1
+    while len(html.escape(text[:cut])) > budget - 1:
+        cut -= len(html.escape(text[:cut])) - (budget - 1)
+    return html.escape(text[:cut]) + "…"
+
+def _blocks(entries, budget):
+    # One block per user in order of their first message, split when it outgrows budget
+    users = {}
+    for user_id, first_name, username, text_html, text in entries:
+        header = _header(user_id, first_name, username)
+        blocks = users.setdefault(user_id, [header])
+        line = _fit(text_html, text, budget - len(header) - 1)
+        if len(blocks[-1]) + len(line) + 1 > budget:
+            blocks.append(header)
+        blocks[-1] += "\n" + line
+    return [(user_id, block) for user_id, blocks in users.items() for block in blocks]
+
+def render(entries):
+    """Split queued entries into [(html_text, [user_id, ...])] under MAX_LENGTH."""
+    if len(entries) == 1:
+        user_id, first_name, username, text_html, text = entries[0]
+        return [(
+            f"📩 <b>Message from {html.escape(first_name or '')}</b> (@{username or 'no_username'})\n"
+            f"ID: {user_id}\n\n{_fit(text_html, text, MAX_LENGTH - 200)}",
+            [user_id]
+        )]
+    title = f"📬 <b>{len(entries)} new messages</b>"
+    messages = []
+    text, user_ids = title, []
+    for user_id, block in _blocks(entries, MAX_LENGTH - 100):
+        if len(text) + len(block) + 2 > MAX_LENGTH or len(user_ids) == MAX_BUTTONS:
+            messages.append((text, user_ids))
+            text, user_ids = title + " (cont.)", []
+        text += "\n\n" + block
+        if user_id not in user_ids:
+            user_ids.append(user_id)
+    messages.append((text, user_ids))
+    return messages
+
+def reply_buttons(user_ids):
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(f"↩️ Reply to {user_id}", callback_data=f"reply_user_{user_id}")]
+        for user_id in user_ids
+    ])
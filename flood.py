@@ -0,0 +1,59 @@
+import time
+from collections import OrderedDict
+from config import FLOOD_LIMIT, FLOOD_WINDOW, FLOOD_AUTOBAN
+
+ALLOWED, LIMITED, WARN, BAN = 'allowed', 'limited', 'warn', 'ban'
+
+# user id -> [window_start, count, previous_count, strikes, warned], least recently seen first
+_users = OrderedDict()
+
+def _evict(now):
+    # A window that started three windows ago means at least two idle windows,
+    # after which the estimate no longer needs the entry
+    while _users:
+        user_id, entry = next(iter(_users.items()))
+        if now - entry[0] < 3 * FLOOD_WINDOW:
+            break
+        del _users[user_id]
+
+def check(user_id, now=None):
+    """Count one message from user_id against the sliding window.
+
+    Uses the two-bucket sliding window estimate (previous window weighted by
+    how much of it still overlaps), so each user costs a fixed five fields.
+    Returns ALLOWED, LIMITED (drop quietly), WARN (drop and tell the user once
+    per window) or BAN (FLOOD_AUTOBAN windows over the limit).
+    """
+    if not FLOOD_LIMIT:
+        return ALLOWED
+    now = time.monotonic() if now is None else now
+    entry = _users.pop(user_id, None)
+    _evict(now)
+    if entry is None:
+        entry = [now, 0, 0, 0, False]
+    elapsed = now - entry[0]
+    if elapsed >= FLOOD_WINDOW:
+        # Roll over; a gap of two windows or more forgets the previous one
+        entry[2] = entry[1] if elapsed < 2 * FLOOD_WINDOW else 0
+        entry[0] += FLOOD_WINDOW * (elapsed // FLOOD_WINDOW)
+        entry[1] = 0
+        entry[4] = False
+        elapsed = now - entry[0]
+    _users[user_id] = entry
+    estimate = entry[2] * (1 - elapsed / FLOOD_WINDOW) + entry[1]
+    if estimate >= FLOOD_LIMIT:
+        if entry[4]:
+            return LIMITED
+        entry[4] = True
+        entry[3] += 1
+        if FLOOD_AUTOBAN and entry[3] >= FLOOD_AUTOBAN:
+            return BAN
+        return WARN
+    entry[1] += 1
+    return ALLOWED
+
+def forget(user_id):
+    _users.pop(user_id, None)
+
+def tracked_users():
+    return len(_users)
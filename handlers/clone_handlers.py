@@ -1,135 +1,168 @@
+import html
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import TelegramError
 from telegram.ext import ContextTypes
 from config import OWNER_ID
-import database as db
+import async_db as db
+import clone_runtime
+import outbox
+from router import CallbackRouter
+
+# (plans, text, markup) for the last plans tuple rendered; the database cache
+# hands out a new tuple whenever plans change, so identity is the cache key.
+_plan_menu = (None, None, None)
+
+def render_plan_menu(plans):
+    global _plan_menu
+    if _plan_menu[0] is plans:
+        return _plan_menu[1], _plan_menu[2]
+    
+    keyboard = []
+    text = "🤖 <b>Get Your Bot Clone!</b>\n\n"
+    text += "Choose a subscription plan:\n\n"
+    
+    for plan in plans:
+        text += f"💳 <b>{plan['name']}</b>\n"
+        text += f"   Price: ₹{plan['price']}\n"
+        text += f"   Duration: {plan['days']} days\n\n"
+        
+        keyboard.append([InlineKeyboardButton(
+            f"💎 {plan['name']} - ₹{plan['price']}",
+            callback_data=f"buy_plan_{plan['id']}"
+        )])
+    
+    keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="main_menu")])
+    
+    _plan_menu = (plans, text, InlineKeyboardMarkup(keyboard))
+    return text, _plan_menu[2]
 
 async def get_clone_bot(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    user = update.effective_user
+    plans = await db.get_all_plans()
     
-    if query.data == "get_clone":
-        plans = db.get_all_plans()
-        
-        if not plans:
-            await query.answer("❌ No plans available!")
-            await query.edit_message_text(
-                "⚠️ Clone bot feature is not available yet.\n"
-                "Please contact Sam for more information."
-            )
-            return
-        
-        keyboard = []
-        text = "🤖 <b>Get Your Bot Clone!</b>\n\n"
-        text += "Choose a subscription plan:\n\n"
-        
-        for plan in plans:
-            text += f"💳 <b>{plan['name']}</b>\n"
-            text += f"   Price: ₹{plan['price']}\n"
-            text += f"   Duration: {plan['days']} days\n\n"
-            
-            keyboard.append([InlineKeyboardButton(
-                f"💎 {plan['name']} - ₹{plan['price']}",
-                callback_data=f"buy_plan_{plan['id']}"
-            )])
-        
-        keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="main_menu")])
-        
-        await query.answer()
+    if not plans:
+        await query.answer("❌ No plans available!")
         await query.edit_message_text(
-            text,
-            parse_mode='HTML',
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            "⚠️ Clone bot feature is not available yet.\n"
+            "Please contact Sam for more information."
         )
+        return
     
-    elif query.data.startswith("buy_plan_"):
-        plan_id = int(query.data.split("_")[2])
-        payment_info = db.get_payment_info()
-        
-        if not payment_info:
-            await query.answer("❌ Payment not configured!")
-            return
-        
-        context.user_data['selected_plan'] = plan_id
-        
-        keyboard = [[InlineKeyboardButton("✅ Paid & Verify", callback_data="paid_verify")]]
-        
-        await query.answer()
-        await context.bot.send_photo(
-            chat_id=user.id,
-            photo=payment_info['qr_code_file_id'],
-            caption=f"💰 <b>Payment Instructions</b>\n\n"
-                    f"UPI ID: <code>{payment_info['upi_id']}</code>\n\n"
-                    f"1. Scan QR or use UPI ID\n"
-                    f"2. Make payment\n"
-                    f"3. Click 'Paid & Verify' below\n"
-                    f"4. Upload payment screenshot",
-            parse_mode='HTML',
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
+    text, reply_markup = render_plan_menu(plans)
     
-    elif query.data == "paid_verify":
-        await query.answer()
-        await query.edit_message_caption(
-            caption="📸 <b>Upload Payment Screenshot</b>\n\n"
-                    "Send me the screenshot of your payment",
-            parse_mode='HTML'
-        )
-        context.user_data['awaiting_payment_screenshot'] = True
+    await query.answer()
+    await query.edit_message_text(
+        text,
+        parse_mode='HTML',
+        reply_markup=reply_markup
+    )
+
+async def buy_plan(update: Update, context: ContextTypes.DEFAULT_TYPE, plan_id):
+    query = update.callback_query
+    user = update.effective_user
+    payment_info = await db.get_payment_info()
     
-    elif query.data.startswith("verify_payment_"):
-        if user.id != OWNER_ID:
-            await query.answer("❌ Access denied!")
-            return
-        
-        payment_id = int(query.data.split("_")[2])
-        payment = db.get_pending_payments()
-        payment = [p for p in payment if p['id'] == payment_id][0]
-        
-        await query.answer()
-        await context.bot.send_photo(
-            chat_id=user.id,
-            photo=payment['screenshot_file_id'],
-            caption=f"💳 <b>Payment Verification</b>\n\n"
-                    f"User: {payment['first_name']} (@{payment['username']})\n"
-                    f"Plan: {payment['plan_name']}\n"
-                    f"Amount: ₹{payment['price']}",
-            parse_mode='HTML',
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("✅ Approve", callback_data=f"approve_payment_{payment_id}")],
-                [InlineKeyboardButton("❌ Reject", callback_data=f"reject_payment_{payment_id}")],
-                [InlineKeyboardButton("🔙 Back", callback_data="verify_payments")]
-            ])
-        )
+    if not payment_info:
+        await query.answer("❌ Payment not configured!")
+        return
     
-    elif query.data.startswith("approve_payment_"):
-        if user.id != OWNER_ID:
-            await query.answer("❌ Access denied!")
-            return
-        
-        payment_id = int(query.data.split("_")[2])
-        payments = db.get_pending_payments()
-        payment = [p for p in payments if p['id'] == payment_id][0]
-        
-        # Create auth key
-        auth_key = db.create_auth_key(payment['user_id'], payment['plan_id'])
-        db.approve_payment(payment_id)
-        
-        # Send auth key to user
-        await context.bot.send_message(
-            chat_id=payment['user_id'],
-            text=f"✅ <b>Payment Approved!</b>\n\n"
-                 f"Your Auth Key:\n<code>{auth_key}</code>\n\n"
-                 f"Now create a new bot with @BotFather and send me the bot token to activate your clone bot!",
-            parse_mode='HTML'
-        )
-        
-        await query.answer("✅ Payment approved!")
-        await query.edit_message_caption(
-            caption=f"✅ Payment approved!\n\nAuth key sent to user.",
-            parse_mode='HTML'
-        )
-        
-        context.user_data['awaiting_bot_token'] = auth_key
+    context.user_data['selected_plan'] = plan_id
+    
+    keyboard = [[InlineKeyboardButton("✅ Paid & Verify", callback_data="paid_verify")]]
+    
+    await query.answer()
+    await outbox.sender(context).send_photo(
+        chat_id=user.id,
+        photo=payment_info['qr_code_file_id'],
+        caption=f"💰 <b>Payment Instructions</b>\n\n"
+                f"UPI ID: <code>{payment_info['upi_id']}</code>\n\n"
+                f"1. Scan QR or use UPI ID\n"
+                f"2. Make payment\n"
+                f"3. Click 'Paid & Verify' below\n"
+                f"4. Upload payment screenshot",
+        parse_mode='HTML',
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+async def paid_verify(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    await query.edit_message_caption(
+        caption="📸 <b>Upload Payment Screenshot</b>\n\n"
+                "Send me the screenshot of your payment",
+        parse_mode='HTML'
+    )
+    context.user_data['awaiting_payment_screenshot'] = True
+
+async def verify_payment(update: Update, context: ContextTypes.DEFAULT_TYPE, payment_id):
+    query = update.callback_query
+    user = update.effective_user
+    
+    if user.id != OWNER_ID:
+        await query.answer("❌ Access denied!")
+        return
+    
+    payment = await db.get_payment_by_id(payment_id)
+    
+    if not payment or payment['status'] != 'pending':
+        await query.answer("❌ Payment not found or already processed!")
+        return
+    
+    await query.answer()
+    await outbox.sender(context, outbox.HIGH).send_photo(
+        chat_id=user.id,
+        photo=payment['screenshot_file_id'],
+        caption=f"💳 <b>Payment Verification</b>\n\n"
+                f"User: {html.escape(payment['first_name'] or '')} (@{payment['username']})\n"
+                f"Plan: {payment['plan_name']}\n"
+                f"Amount: ₹{payment['price']}",
+        parse_mode='HTML',
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("✅ Approve", callback_data=f"approve_payment_{payment_id}")],
+            [InlineKeyboardButton("❌ Reject", callback_data=f"reject_payment_{payment_id}")],
+            [InlineKeyboardButton("🔙 Back", callback_data="verify_payments")]
+        ])
+    )
+
+async def approve_payment(update: Update, context: ContextTypes.DEFAULT_TYPE, payment_id):
+    query = update.callback_query
+    user = update.effective_user
+    
+    if user.id != OWNER_ID:
+        await query.answer("❌ Access denied!")
+        return
+    
+    # Approve and create auth key atomically
+    approved = await db.approve_payment_and_issue_key(payment_id)
+    
+    if not approved:
+        await query.answer("❌ Payment not found or already processed!")
+        return
+    
+    payment_user_id, auth_key = approved
+    
+    # Send auth key to user
+    await outbox.sender(context, outbox.HIGH).send_message(
+        chat_id=payment_user_id,
+        text=f"✅ <b>Payment Approved!</b>\n\n"
+             f"Your Auth Key:\n<code>{auth_key}</code>\n\n"
+             f"Now create a new bot with @BotFather and send me the bot token to activate your clone bot!",
+        parse_mode='HTML'
+    )
+    
+    await query.answer("✅ Payment approved!")
+    await query.edit_message_caption(
+        caption=f"✅ Payment approved!\n\nAuth key sent to user.",
+        parse_mode='HTML'
+    )
+    
+    # The buyer's next text message is their bot token
+    buyer_data = context.application.user_data[payment_user_id]
+    if context.application.persistence:
+        # Load their stored state first, in case it was evicted from memory
+        await context.application.persistence.refresh_user_data(payment_user_id, buyer_data)
+    buyer_data['awaiting_bot_token'] = auth_key
+    context.application.mark_data_for_update_persistence(user_ids=[payment_user_id])
 
 async def handle_payment_screenshot(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -138,9 +171,10 @@ async def handle_payment_screenshot(update: Update, context: ContextTypes.DEFAUL
         plan_id = context.user_data.get('selected_plan')
         file_id = update.message.photo[-1].file_id
         
-        payment_id = db.add_payment_request(user.id, plan_id, file_id)
+        payment_id = await db.add_payment_request(user.id, plan_id, file_id)
         
-        await update.message.reply_text(
+        await outbox.reply(
+            context, update.message,
             "✅ <b>Screenshot Received!</b>\n\n"
             "Your payment is under review.\n"
             "You'll receive your auth key once Sam verifies the payment! ⏳",
@@ -148,14 +182,15 @@ async def handle_payment_screenshot(update: Update, context: ContextTypes.DEFAUL
         )
         
         # Notify owner
-        await context.bot.send_message(
+        notice = await outbox.sender(context, outbox.HIGH).send_message(
             chat_id=OWNER_ID,
             text=f"💳 <b>New Payment Request</b>\n\n"
-                 f"From: {user.first_name} (@{user.username})\n"
+                 f"From: {html.escape(user.first_name)} (@{user.username})\n"
                  f"Payment ID: {payment_id}\n\n"
                  f"Use /verify to review",
             parse_mode='HTML'
         )
+        await db.add_reply_routes(context.bot.id, [notice.message_id], user.id)
         
         context.user_data['awaiting_payment_screenshot'] = False
         context.user_data['selected_plan'] = None
@@ -167,14 +202,59 @@ async def handle_bot_token(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if auth_key and update.message.text.count(':') == 1:
         bot_token = update.message.text.strip()
         
-        if db.activate_auth_key(auth_key, bot_token):
-            await update.message.reply_text(
-                "�� <b>Clone Bot Activated!</b>\n\n"
-                "Your bot is now live! Start using it to communicate with your users.\n\n"
-                "Your bot has basic send/receive features.\n"
-                "Happy chatting! 🚀",
-                parse_mode='HTML'
+        # Checked before the clone starts taking this token's updates
+        if not await db.get_pending_auth_key(auth_key):
+            await outbox.reply(
+                context, update.message,
+                "❌ This auth key is invalid or already used!\n"
+                "Please contact Sam if you think this is a mistake."
             )
             context.user_data['awaiting_bot_token'] = None
-        else:
-            await update.message.reply_text("❌ Invalid auth key!")
+            return
+        
+        if await db.bot_token_in_use(bot_token):
+            await outbox.reply(
+                context, update.message,
+                "❌ This bot is already running as a clone!\n"
+                "Create a new bot with @BotFather and send its token."
+            )
+            return
+        
+        # Starting the clone is what checks the token with Telegram
+        try:
+            await clone_runtime.start_clone(auth_key, bot_token, user.id, user.first_name)
+        except TelegramError:
+            await outbox.reply(
+                context, update.message,
+                "❌ Telegram rejected this bot token.\n"
+                "Copy it again from @BotFather and send it here."
+            )
+            return
+        
+        activated = False
+        try:
+            activated = await db.activate_auth_key(auth_key, bot_token)
+        finally:
+            if not activated:
+                await clone_runtime.stop_clone(auth_key)
+        
+        if not activated:
+            await outbox.reply(context, update.message, "❌ Could not activate your clone bot. Please send the token again.")
+            return
+        
+        await outbox.reply(
+            context, update.message,
+            "🎉 <b>Clone Bot Activated!</b>\n\n"
+            "Your bot is now live! Start using it to communicate with your users.\n\n"
+            "Your bot has basic send/receive features.\n"
+            "Happy chatting! 🚀",
+            parse_mode='HTML'
+        )
+        context.user_data['awaiting_bot_token'] = None
+
+callbacks = CallbackRouter()
+callbacks.add("get_clone", get_clone_bot)
+callbacks.add("paid_verify", paid_verify)
+callbacks.add_prefix("buy_plan_", buy_plan, int)
+callbacks.add_prefix("verify_payment_", verify_payment, int)
+callbacks.add_prefix("approve_payment_", approve_payment, int)
@@ -1,13 +1,17 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from config import OWNER_ID
-import database as db
+import async_db as db
+import clone_runtime
+import outbox
+from router import CallbackRouter
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
     if user.id == OWNER_ID:
-        await update.message.reply_text(
+        await outbox.reply(
+            context, update.message,
             f"👑 Welcome back, Sam!\n\n"
             f"Use /panel to access your owner dashboard.",
             reply_markup=InlineKeyboardMarkup([[
@@ -15,12 +19,13 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             ]])
         )
     else:
-        db.add_user(user.id, user.username, user.first_name)
+        await db.add_user(user.id, user.username, user.first_name)
         keyboard = [
             [InlineKeyboardButton("📩 Send Message to Sam", callback_data="send_to_owner")],
             [InlineKeyboardButton("🤖 Get Bot Clone", callback_data="get_clone")]
         ]
-        await update.message.reply_text(
+        await outbox.reply(
+            context, update.message,
             f"👋 Hello {user.first_name}!\n\n"
             f"Welcome to Sam's Bot! 🌟\n\n"
             f"You can:\n"
@@ -39,8 +44,7 @@ async def owner_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await query.answer("❌ Access denied!")
         return
     
-    user_count = db.get_user_count()
-    banned_count = len(db.get_banned_users())
+    stats = await db.get_stats()
     
     keyboard = [
         [InlineKeyboardButton("📊 Statistics", callback_data="show_stats")],
@@ -57,8 +61,8 @@ async def owner_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = (
         f"👑 <b>Owner Dashboard</b>\n\n"
         f"📊 <b>Quick Stats:</b>\n"
-        f"• Active Users: {user_count}\n"
-        f"• Banned Users: {banned_count}\n\n"
+        f"• Active Users: {stats['active_users']}\n"
+        f"• Banned Users: {stats['banned_users']}\n\n"
         f"Select an option below:"
     )
     
@@ -66,7 +70,7 @@ async def owner_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.answer()
         await query.edit_message_text(text, parse_mode='HTML', reply_markup=InlineKeyboardMarkup(keyboard))
     else:
-        await update.message.reply_text(text, parse_mode='HTML', reply_markup=InlineKeyboardMarkup(keyboard))
+        await outbox.reply(context, update.message, text, parse_mode='HTML', reply_markup=InlineKeyboardMarkup(keyboard))
 
 async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -75,21 +79,30 @@ async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.answer("❌ Access denied!")
         return
     
-    users = db.get_all_users()
-    banned = db.get_banned_users()
-    plans = db.get_all_plans()
-    active_keys = db.get_active_auth_keys()
+    stats = await db.get_stats()
+    ban_stats = await db.get_ban_stats()
+    out = outbox.of(context).stats()
+    state = context.bot_data['eviction'].report()
     
     text = (
         f"📊 <b>Detailed Statistics</b>\n\n"
         f"👥 <b>Users:</b>\n"
-        f"• Total Active: {len(users)}\n"
-        f"• Total Banned: {len(banned)}\n\n"
+        f"• Total Active: {stats['active_users']}\n"
+        f"• Total Banned: {stats['banned_users']}\n"
+        f"• Unreachable (pruned): {stats['unreachable_users']}\n"
+        f"• Ban Checks: {ban_stats['checks']} ({ban_stats['hits']} blocked)\n\n"
         f"💳 <b>Subscriptions:</b>\n"
-        f"• Active Plans: {len(plans)}\n"
-        f"• Active Keys: {len(active_keys)}\n\n"
+        f"• Active Plans: {stats['plans']}\n"
+        f"• Active Keys: {stats['active_keys']}\n\n"
         f"🤖 <b>Clone Bots:</b>\n"
-        f"• Active Clones: {len([k for k in active_keys if k['bot_token']])}"
+        f"• Active Clones: {stats['active_clones']} ({clone_runtime.running()} running)\n\n"
+        f"📤 <b>Outbox:</b>\n"
+        f"• Queued: {out['depth']} ({out['in_flight']} in flight)\n"
+        f"• Sent: {out['sent']} | Failed: {out['failed']} | Retried: {out['retried']}\n"
+        f"• Latency: avg {out['latency_avg'] * 1000:.0f} ms, max {out['latency_max'] * 1000:.0f} ms\n\n"
+        f"🧠 <b>User State:</b>\n"
+        f"• In memory: {state['in_memory']} ({state['with_state']} mid-workflow), ~{state['bytes'] // 1024} KiB\n"
+        f"• Stored: {state.get('stored_users', 0)} | Evicted: {state['evicted']}"
     )
     
     keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="owner_panel")]]
@@ -97,47 +110,59 @@ async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     await query.edit_message_text(text, parse_mode='HTML', reply_markup=InlineKeyboardMarkup(keyboard))
 
-async def list_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
+def page_buttons(kind, rows, key, has_prev, has_next):
+    """Prev/Next buttons for a keyset-paginated list, e.g. callback data pg_u_n_123."""
+    buttons = []
+    if rows and has_prev:
+        buttons.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"pg_{kind}_p_{rows[0][key]}"))
+    if rows and has_next:
+        buttons.append(InlineKeyboardButton("Next ➡️", callback_data=f"pg_{kind}_n_{rows[-1][key]}"))
+    return [buttons] if buttons else []
+
+async def list_users(update: Update, context: ContextTypes.DEFAULT_TYPE, after=None, before=None):
     query = update.callback_query
     
     if update.effective_user.id != OWNER_ID:
         await query.answer("❌ Access denied!")
         return
     
-    users = db.get_all_users()
+    users, has_prev, has_next = await db.get_users_page(after=after, before=before)
     
-    if not users:
+    if not users and after is None and before is None:
         await query.answer("No active users!")
         return
     
+    stats = await db.get_stats()
+    
     keyboard = []
-    for user in users[:20]:  # Limit to 20 for button limit
+    for user in users:  # Pages of 20 to stay within button limits
         username = user['username'] or user['first_name']
         keyboard.append([InlineKeyboardButton(
             f"👤 {username} (ID: {user['user_id']})",
             callback_data=f"user_action_{user['user_id']}"
         )])
     
+    keyboard += page_buttons("u", users, 'user_id', has_prev, has_next)
     keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="owner_panel")])
     
     await query.answer()
     await query.edit_message_text(
-        f"👥 <b>Active Users ({len(users)})</b>\n\n"
+        f"👥 <b>Active Users ({stats['active_users']})</b>\n\n"
         f"Click on a user for actions:",
         parse_mode='HTML',
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
 
-async def list_banned(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def list_banned(update: Update, context: ContextTypes.DEFAULT_TYPE, after=None, before=None):
     query = update.callback_query
     
     if update.effective_user.id != OWNER_ID:
         await query.answer("❌ Access denied!")
         return
     
-    users = db.get_banned_users()
+    users, has_prev, has_next = await db.get_users_page(banned=True, after=after, before=before)
     
-    if not users:
+    if not users and after is None and before is None:
         await query.answer("No banned users!")
         await query.edit_message_text(
             "🚫 No banned users",
@@ -145,19 +170,22 @@ async def list_banned(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
+    stats = await db.get_stats()
+    
     keyboard = []
-    for user in users[:20]:
+    for user in users:
         username = user['username'] or user['first_name']
         keyboard.append([InlineKeyboardButton(
             f"🚫 {username} (ID: {user['user_id']})",
             callback_data=f"unban_{user['user_id']}"
         )])
     
+    keyboard += page_buttons("b", users, 'user_id', has_prev, has_next)
     keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="owner_panel")])
     
     await query.answer()
     await query.edit_message_text(
-        f"🚫 <b>Banned Users ({len(users)})</b>\n\n"
+        f"🚫 <b>Banned Users ({stats['banned_users']})</b>\n\n"
         f"Click to unban:",
         parse_mode='HTML',
         reply_markup=InlineKeyboardMarkup(keyboard)
@@ -170,7 +198,7 @@ async def manage_plans(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.answer("❌ Access denied!")
         return
     
-    plans = db.get_all_plans()
+    plans = await db.get_all_plans()
     
     text = "💳 <b>Subscription Plans</b>\n\n"
     keyboard = []
@@ -199,7 +227,7 @@ async def set_payment_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await query.answer("❌ Access denied!")
         return
     
-    payment_info = db.get_payment_info()
+    payment_info = await db.get_payment_info()
     
     text = "💰 <b>Payment Information</b>\n\n"
     if payment_info:
@@ -216,24 +244,24 @@ async def set_payment_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.answer()
         await query.edit_message_text(text, parse_mode='HTML', reply_markup=InlineKeyboardMarkup(keyboard))
     else:
-        await update.message.reply_text(text, parse_mode='HTML', reply_markup=InlineKeyboardMarkup(keyboard))
+        await outbox.reply(context, update.message, text, parse_mode='HTML', reply_markup=InlineKeyboardMarkup(keyboard))
     
     context.user_data['awaiting_payment_info'] = True
 
-async def manage_auth_keys(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def manage_auth_keys(update: Update, context: ContextTypes.DEFAULT_TYPE, after=None, before=None):
     query = update.callback_query
     
     if update.effective_user.id != OWNER_ID:
         await query.answer("❌ Access denied!")
         return
     
-    keys = db.get_active_auth_keys()
+    keys, has_prev, has_next = await db.get_active_auth_keys_page(after=after, before=before)
     
     text = "🔑 <b>Active Auth Keys</b>\n\n"
     keyboard = []
     
     if keys:
-        for key in keys[:15]:
+        for key in keys:
             username = key['username'] or key['first_name']
             text += f"• {username}: {key['plan_name']}\n"
             keyboard.append([InlineKeyboardButton(
@@ -243,21 +271,22 @@ async def manage_auth_keys(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         text += "No active keys"
     
+    keyboard += page_buttons("k", keys, 'key', has_prev, has_next)
     keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="owner_panel")])
     
     await query.answer()
     await query.edit_message_text(text, parse_mode='HTML', reply_markup=InlineKeyboardMarkup(keyboard))
 
-async def verify_payments(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def verify_payments(update: Update, context: ContextTypes.DEFAULT_TYPE, after=None, before=None):
     query = update.callback_query
     
     if update.effective_user.id != OWNER_ID:
         await query.answer("❌ Access denied!")
         return
     
-    payments = db.get_pending_payments()
+    payments, has_prev, has_next = await db.get_pending_payments_page(after=after, before=before)
     
-    if not payments:
+    if not payments and after is None and before is None:
         await query.answer("No pending payments!")
         await query.edit_message_text(
             "✅ No pending payment verifications",
@@ -265,19 +294,22 @@ async def verify_payments(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
+    stats = await db.get_stats()
+    
     keyboard = []
-    for payment in payments[:10]:
+    for payment in payments:
         username = payment['username'] or payment['first_name']
         keyboard.append([InlineKeyboardButton(
             f"💳 {username} - {payment['plan_name']} (₹{payment['price']})",
             callback_data=f"verify_payment_{payment['id']}"
         )])
     
+    keyboard += page_buttons("v", payments, 'id', has_prev, has_next)
     keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="owner_panel")])
     
     await query.answer()
     await query.edit_message_text(
-        f"✅ <b>Pending Verifications ({len(payments)})</b>\n\n"
+        f"✅ <b>Pending Verifications ({stats['pending_payments']})</b>\n\n"
         f"Click to review:",
         parse_mode='HTML',
         reply_markup=InlineKeyboardMarkup(keyboard)
@@ -287,7 +319,8 @@ async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != OWNER_ID:
         return
     
-    await update.message.reply_text(
+    await outbox.reply(
+        context, update.message,
         "📢 <b>Broadcast Mode</b>\n\n"
         "Send me the message you want to broadcast to all users.\n"
         "You can send text, photos, videos, files, or polls!",
@@ -295,63 +328,85 @@ async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     context.user_data['broadcast_mode'] = True
 
-async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+# Keyset-paginated lists: pg_<list>_<n|p>_<key> pages after/before key
+PAGED_LISTS = {
+    "u": (list_users, int),
+    "b": (list_banned, int),
+    "k": (manage_auth_keys, str),  # auth keys may contain "_"
+    "v": (verify_payments, int),
+}
+
+def page_callback(handler, direction):
+    async def show_page(update: Update, context: ContextTypes.DEFAULT_TYPE, key):
+        await handler(update, context, **{direction: key})
+    return show_page
+
+async def unban_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id):
+    await db.unban_user(user_id)
+    await update.callback_query.answer("✅ User unbanned!")
+    await list_banned(update, context)
+
+async def delete_plan_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, plan_id):
+    await db.delete_plan(plan_id)
+    await update.callback_query.answer("✅ Plan deleted!")
+    await manage_plans(update, context)
+
+async def revoke_key_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, key):
+    await db.revoke_auth_key(key)
+    await clone_runtime.stop_clone(key)
+    await update.callback_query.answer("✅ Key revoked!")
+    await manage_auth_keys(update, context)
+
+async def user_actions(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id):
     query = update.callback_query
-    data = query.data
-    
-    if data == "owner_panel":
-        await owner_panel(update, context)
-    elif data == "show_stats":
-        await show_stats(update, context)
-    elif data == "list_users":
-        await list_users(update, context)
-    elif data == "list_banned":
-        await list_banned(update, context)
-    elif data == "manage_plans":
-        await manage_plans(update, context)
-    elif data == "set_payment":
-        await set_payment_info(update, context)
-    elif data == "manage_auth_keys":
-        await manage_auth_keys(update, context)
-    elif data == "verify_payments":
-        await verify_payments(update, context)
-    elif data.startswith("unban_"):
-        user_id = int(data.split("_")[1])
-        db.unban_user(user_id)
-        await query.answer("✅ User unbanned!")
-        await list_banned(update, context)
-    elif data.startswith("delete_plan_"):
-        plan_id = int(data.split("_")[2])
-        db.delete_plan(plan_id)
-        await query.answer("✅ Plan deleted!")
-        await manage_plans(update, context)
-    elif data.startswith("revoke_key_"):
-        key = data.replace("revoke_key_", "")
-        db.revoke_auth_key(key)
-        await query.answer("✅ Key revoked!")
-        await manage_auth_keys(update, context)
-    elif data.startswith("user_action_"):
-        user_id = int(data.split("_")[2])
-        keyboard = [
-            [InlineKeyboardButton("💬 Send Message", callback_data=f"msg_user_{user_id}")],
-            [InlineKeyboardButton("🚫 Ban User", callback_data=f"ban_user_{user_id}")],
-            [InlineKeyboardButton("🔙 Back", callback_data="list_users")]
-        ]
-        await query.answer()
-        await query.edit_message_text(
-            f"👤 <b>User Actions</b>\n\nUser ID: {user_id}",
-            parse_mode='HTML',
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-    elif data.startswith("ban_user_"):
-        user_id = int(data.split("_")[2])
-        db.ban_user(user_id)
-        await query.answer("✅ User banned!")
-        await list_users(update, context)
-    elif data.startswith("msg_user_"):
-        user_id = int(data.split("_")[2])
-        context.user_data['send_to_user'] = user_id
-        await query.answer()
-        await query.edit_message_text(
-            f"💬 Send your message for user {user_id}:"
-        )
+    keyboard = [
+        [InlineKeyboardButton("💬 Send Message", callback_data=f"msg_user_{user_id}")],
+        [InlineKeyboardButton("🚫 Ban User", callback_data=f"ban_user_{user_id}")],
+        [InlineKeyboardButton("🔙 Back", callback_data="list_users")]
+    ]
+    await query.answer()
+    await query.edit_message_text(
+        f"👤 <b>User Actions</b>\n\nUser ID: {user_id}",
+        parse_mode='HTML',
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+async def ban_user_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id):
+    await db.ban_user(user_id)
+    await update.callback_query.answer("✅ User banned!")
+    await list_users(update, context)
+
+async def msg_user_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id):
+    query = update.callback_query
+    context.user_data['send_to_user'] = user_id
+    await query.answer()
+    await query.edit_message_text(
+        f"💬 Send your message for user {user_id}:"
+    )
+
+async def reply_user_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id):
+    # From an owner digest: prompt separately so the digest stays intact
+    query = update.callback_query
+    context.user_data['send_to_user'] = user_id
+    await query.answer()
+    await outbox.reply(context, query.message, f"💬 Send your message for user {user_id}:")
+
+callbacks = CallbackRouter()
+callbacks.add("owner_panel", owner_panel)
+callbacks.add("show_stats", show_stats)
+callbacks.add("list_users", list_users)
+callbacks.add("list_banned", list_banned)
+callbacks.add("manage_plans", manage_plans)
+callbacks.add("set_payment", set_payment_info)
+callbacks.add("manage_auth_keys", manage_auth_keys)
+callbacks.add("verify_payments", verify_payments)
+for kind, (handler, key_type) in PAGED_LISTS.items():
+    callbacks.add_prefix(f"pg_{kind}_n_", page_callback(handler, "after"), key_type)
+    callbacks.add_prefix(f"pg_{kind}_p_", page_callback(handler, "before"), key_type)
+callbacks.add_prefix("unban_", unban_callback, int)
+callbacks.add_prefix("delete_plan_", delete_plan_callback, int)
+callbacks.add_prefix("revoke_key_", revoke_key_callback, str)
+callbacks.add_prefix("user_action_", user_actions, int)
+callbacks.add_prefix("ban_user_", ban_user_callback, int)
+callbacks.add_prefix("msg_user_", msg_user_callback, int)
+callbacks.add_prefix("reply_user_", reply_user_callback, int)
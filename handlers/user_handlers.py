@@ -1,201 +1,216 @@
+import asyncio
+import html
 import random
 from telegram import Update
 from telegram.ext import ContextTypes
-from config import OWNER_ID, GREETINGS
-import database as db
+from config import OWNER_ID, OWNER_NAME, GREETINGS
+import async_db as db
+import broadcast
+import digest
+import outbox
+import relay
+
+def owner_id(context):
+    # Clone bots keep their owner in bot_data; the main bot is OWNER_ID's
+    return context.bot_data.get('owner_id', OWNER_ID)
+
+def is_clone(context):
+    return 'owner_id' in context.bot_data
+
+def owner_name(context):
+    return context.bot_data.get('owner_name', OWNER_NAME)
+
+def greeting(context):
+    return random.choice(GREETINGS).format(owner=owner_name(context))
+
+# (bot id, user id) -> that user's latest background forward to the owner
+_forwards = {}
+
+def forward_later(context, user_id, deliver):
+    """Run deliver() in the background, after the user's earlier forwards.
+
+    Sends to the owner chat wait out its per-chat interval in the outbox;
+    waiting outside the handler leaves the update slot to other users and
+    to the owner meanwhile.
+    """
+    key = (context.bot.id, user_id)
+    previous = _forwards.get(key)
+    
+    async def run():
+        if previous is not None:
+            await asyncio.wait([previous])
+        await deliver()
+    
+    task = _forwards[key] = context.application.create_task(run())
+    task.add_done_callback(lambda done: _forwards.pop(key) if _forwards.get(key) is done else None)
+
+async def wait_forwards(bot_id):
+    """Wait for bot_id's background forwards; each user's latest one follows all earlier ones."""
+    tasks = [task for (forward_bot_id, _), task in _forwards.items() if forward_bot_id == bot_id]
+    if tasks:
+        await asyncio.wait(tasks)
+
+async def is_banned(context, user_id):
+    # users and its bans belong to the main bot; a clone only has its owner's bans
+    if is_clone(context):
+        return await db.is_banned_in_bot(context.bot.id, user_id)
+    return await db.is_user_banned(user_id)
+
+async def owner_target(context, message):
+    """User an owner message is meant for: the sender of the relayed message
+    being replied to, else the one picked with the panel's send buttons."""
+    if message.reply_to_message:
+        user_id = await db.get_reply_route(context.bot.id, message.reply_to_message.message_id)
+        if user_id:
+            return user_id
+    return context.user_data.pop('send_to_user', None)
+
+async def remember_sender(context, sent, user_id):
+    # Lets the owner answer a relayed message with a plain Telegram reply
+    messages = sent if isinstance(sent, (list, tuple)) else [sent]
+    await db.add_reply_routes(context.bot.id, [m.message_id for m in messages], user_id)
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     message = update.message
+    owner = owner_id(context)
     
     # Check if banned
-    if db.is_user_banned(user.id):
-        await message.reply_text("🚫 You have been banned from using this bot.")
+    if await is_banned(context, user.id):
+        await outbox.reply(context, message, "🚫 You have been banned from using this bot.")
         return
     
-    # Update last active
-    db.update_last_active(user.id)
+    # Update last active; clone users are not in users
+    if not is_clone(context):
+        await db.update_last_active(user.id)
     
-    # Owner sending to specific user
-    if user.id == OWNER_ID and context.user_data.get('send_to_user'):
-        target_user_id = context.user_data['send_to_user']
+    # Owner replying to a relayed message, or sending to a specific user
+    target_user_id = await owner_target(context, message) if user.id == owner else None
+    if target_user_id:
         try:
-            await context.bot.send_message(
-                chat_id=target_user_id,
-                text=f"💬 <b>Message from Sam:</b>\n\n{message.text}",
-                parse_mode='HTML'
+            await relay.relay_messages(
+                outbox.sender(context, outbox.HIGH), target_user_id, [message],
+                f"💬 <b>Message from {html.escape(owner_name(context))}:</b>"
             )
-            await message.reply_text(f"✅ Message sent to user {target_user_id}!")
+            await db.journal_message(context.bot.id, owner, target_user_id, 'text', message.text)
+            await outbox.reply(context, message, f"✅ Message sent to user {target_user_id}!")
         except Exception as e:
-            await message.reply_text(f"❌ Failed to send: {str(e)}")
-        context.user_data['send_to_user'] = None
+            await outbox.reply(context, message, f"❌ Failed to send: {str(e)}")
         return
     
     # Owner broadcast mode
-    if user.id == OWNER_ID and context.user_data.get('broadcast_mode'):
-        users = db.get_all_users()
-        success = 0
-        failed = 0
-        
-        for u in users:
-            try:
-                await context.bot.send_message(
-                    chat_id=u['user_id'],
-                    text=f"📢 <b>Broadcast from Sam:</b>\n\n{message.text}",
-                    parse_mode='HTML'
-                )
-                success += 1
-            except:
-                failed += 1
-        
-        await message.reply_text(
-            f"✅ Broadcast complete!\n\n"
-            f"Sent: {success}\n"
-            f"Failed: {failed}"
-        )
+    if user.id == owner and context.user_data.get('broadcast_mode'):
+        await broadcast.start_broadcast(outbox.of(context), message.chat_id, {
+            'kind': 'text',
+            'text': f"📢 <b>Broadcast from {html.escape(owner_name(context))}:</b>\n\n{message.text_html}",
+        })
+        await db.journal_message(context.bot.id, owner, None, 'text', message.text)
         context.user_data['broadcast_mode'] = False
         return
     
     # Owner receiving payment QR/UPI
-    if user.id == OWNER_ID and context.user_data.get('awaiting_payment_info'):
-        await message.reply_text("Please send QR code image first, then UPI ID")
+    if user.id == owner and context.user_data.get('awaiting_payment_info'):
+        await outbox.reply(context, message, "Please send QR code image first, then UPI ID")
         return
     
     # Regular user sending to owner
-    if user.id != OWNER_ID:
-        try:
-            await context.bot.send_message(
-                chat_id=OWNER_ID,
-                text=f"📩 <b>Message from {user.first_name}</b> (@{user.username or 'no_username'})\n"
-                     f"ID: {user.id}\n\n{message.text}",
-                parse_mode='HTML'
-            )
-            greeting = random.choice(GREETINGS)
-            await message.reply_text(greeting)
-        except Exception as e:
-            await message.reply_text("❌ Failed to send message. Please try again later.")
+    if user.id != owner:
+        if digest.enabled():
+            digest.add(context, user, message)
+            await db.journal_message(context.bot.id, user.id, owner, 'text', message.text)
+            await outbox.reply(context, message, greeting(context))
+            return
+        
+        async def deliver():
+            try:
+                sent = await relay.relay_messages(
+                    outbox.sender(context), owner, [message],
+                    f"📩 <b>Message from {html.escape(user.first_name)}</b> (@{user.username or 'no_username'})\n"
+                    f"ID: {user.id}"
+                )
+                await remember_sender(context, sent, user.id)
+                await db.journal_message(context.bot.id, user.id, owner, 'text', message.text)
+                await outbox.reply(context, message, greeting(context))
+            except Exception as e:
+                await outbox.reply(context, message, "❌ Failed to send message. Please try again later.")
+        
+        forward_later(context, user.id, deliver)
 
 async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     message = update.message
+    owner = owner_id(context)
     
-    if db.is_user_banned(user.id):
-        await message.reply_text("🚫 You have been banned from using this bot.")
+    if await is_banned(context, user.id):
+        await outbox.reply(context, message, "🚫 You have been banned from using this bot.")
         return
     
-    db.update_last_active(user.id)
+    if not is_clone(context):
+        await db.update_last_active(user.id)
+    
+    # Later items of an album that is already being collected
+    if relay.join_album(message):
+        return
     
     # Owner handling payment QR
-    if user.id == OWNER_ID and context.user_data.get('awaiting_payment_info') and message.photo:
+    if user.id == owner and context.user_data.get('awaiting_payment_info') and message.photo:
         file_id = message.photo[-1].file_id
         context.user_data['payment_qr'] = file_id
-        await message.reply_text("✅ QR Code saved! Now send me the UPI ID:")
+        await outbox.reply(context, message, "✅ QR Code saved! Now send me the UPI ID:")
         return
     
-    # Owner sending media to specific user
-    if user.id == OWNER_ID and context.user_data.get('send_to_user'):
-        target_user_id = context.user_data['send_to_user']
-        try:
-            caption = f"💬 <b>Message from Sam:</b>\n\n{message.caption or ''}"
-            
-            if message.photo:
-                await context.bot.send_photo(target_user_id, message.photo[-1].file_id, caption=caption, parse_mode='HTML')
-            elif message.video:
-                await context.bot.send_video(target_user_id, message.video.file_id, caption=caption, parse_mode='HTML')
-            elif message.document:
-                await context.bot.send_document(target_user_id, message.document.file_id, caption=caption, parse_mode='HTML')
-            elif message.audio:
-                await context.bot.send_audio(target_user_id, message.audio.file_id, caption=caption, parse_mode='HTML')
-            elif message.voice:
-                await context.bot.send_voice(target_user_id, message.voice.file_id, caption=caption, parse_mode='HTML')
-            
-            await message.reply_text(f"✅ Media sent to user {target_user_id}!")
-        except Exception as e:
-            await message.reply_text(f"❌ Failed to send: {str(e)}")
-        context.user_data['send_to_user'] = None
+    # Owner replying with media to a relayed message, or sending to a specific user
+    target_user_id = await owner_target(context, message) if user.id == owner else None
+    if target_user_id:
+        
+        async def deliver(messages):
+            try:
+                await relay.relay_messages(
+                    outbox.sender(context, outbox.HIGH), target_user_id, messages, f"💬 <b>Message from {html.escape(owner_name(context))}:</b>"
+                )
+                await db.journal_message(context.bot.id, owner, target_user_id, relay.journal_type(messages), messages[0].caption)
+                await outbox.reply(context, message, f"✅ Media sent to user {target_user_id}!")
+            except Exception as e:
+                await outbox.reply(context, message, f"❌ Failed to send: {str(e)}")
+        
+        if not relay.collect_album(context.application, message, deliver):
+            await deliver([message])
         return
     
     # Owner broadcast mode
-    if user.id == OWNER_ID and context.user_data.get('broadcast_mode'):
-        users = db.get_all_users()
-        success = 0
-        failed = 0
-        caption = f"📢 <b>Broadcast from Sam:</b>\n\n{message.caption or ''}"
+    if user.id == owner and context.user_data.get('broadcast_mode'):
+        context.user_data['broadcast_mode'] = False
         
-        for u in users:
-            try:
-                if message.photo:
-                    await context.bot.send_photo(u['user_id'], message.photo[-1].file_id, caption=caption, parse_mode='HTML')
-                elif message.video:
-                    await context.bot.send_video(u['user_id'], message.video.file_id, caption=caption, parse_mode='HTML')
-                elif message.document:
-                    await context.bot.send_document(u['user_id'], message.document.file_id, caption=caption, parse_mode='HTML')
-                success += 1
-            except:
-                failed += 1
+        async def deliver(messages):
+            header = f"📢 <b>Broadcast from {html.escape(owner_name(context))}:</b>"
+            if len(messages) > 1:
+                payload = {'kind': 'album', 'media': relay.album_media(messages, header)}
+            else:
+                payload = {
+                    'kind': 'copy',
+                    'from_chat_id': message.chat_id,
+                    'message_id': messages[0].message_id,
+                    'caption': relay.copy_caption(messages[0], header),
+                }
+            await broadcast.start_broadcast(outbox.of(context), message.chat_id, payload)
+            await db.journal_message(context.bot.id, owner, None, relay.journal_type(messages), messages[0].caption)
         
-        await message.reply_text(f"✅ Broadcast complete!\n\nSent: {success}\nFailed: {failed}")
-        context.user_data['broadcast_mode'] = False
+        if not relay.collect_album(context.application, message, deliver):
+            await deliver([message])
         return
     
     # Regular user sending media to owner
-    if user.id != OWNER_ID:
-        try:
-            caption = f"📩 <b>Media from {user.first_name}</b> (@{user.username or 'no_username'})\nID: {user.id}\n\n{message.caption or ''}"
-            
-            if message.photo:
-                await context.bot.send_photo(OWNER_ID, message.photo[-1].file_id, caption=caption, parse_mode='HTML')
-            elif message.video:
-                await context.bot.send_video(OWNER_ID, message.video.file_id, caption=caption, parse_mode='HTML')
-            elif message.document:
-                await context.bot.send_document(OWNER_ID, message.document.file_id, caption=caption, parse_mode='HTML')
-            elif message.audio:
-                await context.bot.send_audio(OWNER_ID, message.audio.file_id, caption=caption, parse_mode='HTML')
-            elif message.voice:
-                await context.bot.send_voice(OWNER_ID, message.voice.file_id, caption=caption, parse_mode='HTML')
-            
-            greeting = random.choice(GREETINGS)
-            await message.reply_text(greeting)
-        except Exception as e:
-            await message.reply_text("❌ Failed to send media. Please try again later.")
-
-async def handle_poll(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.effective_user
-    message = update.message
-    
-    if db.is_user_banned(user.id):
-        await message.reply_text("🚫 You have been banned from using this bot.")
-        return
-    
-    if user.id == OWNER_ID and context.user_data.get('broadcast_mode'):
-        users = db.get_all_users()
-        success = 0
+    if user.id != owner:
+        header = f"📩 <b>Media from {html.escape(user.first_name)}</b> (@{user.username or 'no_username'})\nID: {user.id}"
         
-        for u in users:
+        async def deliver(messages):
             try:
-                await context.bot.forward_message(
-                    chat_id=u['user_id'],
-                    from_chat_id=message.chat_id,
-                    message_id=message.message_id
-                )
-                success += 1
-            except:
-                pass
+                sent = await relay.relay_messages(outbox.sender(context), owner, messages, header)
+                await remember_sender(context, sent, user.id)
+                await db.journal_message(context.bot.id, user.id, owner, relay.journal_type(messages), messages[0].caption)
+                await outbox.reply(context, message, greeting(context))
+            except Exception as e:
+                await outbox.reply(context, message, "❌ Failed to send media. Please try again later.")
         
-        await message.reply_text(f"✅ Poll broadcast to {success} users!")
-        context.user_data['broadcast_mode'] = False
-    elif user.id != OWNER_ID:
-        try:
-            await context.bot.forward_message(
-                chat_id=OWNER_ID,
-                from_chat_id=message.chat_id,
-                message_id=message.message_id
-            )
-            await context.bot.send_message(
-                chat_id=OWNER_ID,
-                text=f"📊 Poll from {user.first_name} (@{user.username or 'no_username'})\nID: {user.id}"
-            )
-            greeting = random.choice(GREETINGS)
-            await message.reply_text(greeting)
-        except:
-            await message.reply_text("❌ Failed to send poll.")
+        if not relay.collect_album(context.application, message, deliver):
+            forward_later(context, user.id, lambda: deliver([message]))
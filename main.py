@@ -1,8 +1,23 @@
 import logging
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters
-from config import BOT_TOKEN, OWNER_ID
+from telegram import Update
+from telegram.ext import (
+    Application, CallbackQueryHandler, CommandHandler, ContextTypes, MessageHandler, TypeHandler, filters
+)
+from config import (
+    BOT_TOKEN, CONCURRENT_UPDATES, OWNER_ID, UPDATE_QUEUE_SIZE,
+    WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_URL
+)
 from handlers import owner_handlers, user_handlers, clone_handlers
 from database import init_db
+import async_db
+import broadcast
+import clone_runtime
+import flood
+import outbox
+from persistence import SQLitePersistence
+from router import CallbackRouter
+from update_processor import PerUserUpdateProcessor, UpdateQueue
+from user_state import IdleEviction, UserState
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -11,22 +26,34 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-async def handle_callback(update, context):
+async def send_to_owner(update, context):
     query = update.callback_query
-    data = query.data
-    
-    # Route to appropriate handler
-    if data in ["get_clone", "paid_verify", "main_menu"] or data.startswith(("buy_plan_", "verify_payment_", "approve_payment_", "reject_payment_")):
-        await clone_handlers.get_clone_bot(update, context)
-    elif data == "send_to_owner":
-        await query.answer()
-        await query.edit_message_text("💬 Send me your message and I'll forward it to Sam!")
-    else:
-        await owner_handlers.button_callback(update, context)
+    await query.answer()
+    await query.edit_message_text("💬 Send me your message and I'll forward it to Sam!")
+
+# Every inline button, routed by its callback_data
+callbacks = CallbackRouter()
+callbacks.include(owner_handlers.callbacks)
+callbacks.include(clone_handlers.callbacks)
+callbacks.add("send_to_owner", send_to_owner)
 
 async def handle_all_messages(update, context):
     user = update.effective_user
     
+    # Flood control runs before any DB or API work
+    if user.id != OWNER_ID:
+        verdict = flood.check(user.id)
+        if verdict == flood.LIMITED:
+            return
+        if verdict == flood.WARN:
+            await outbox.reply(context, update.message, "⏳ You're sending messages too fast. Please slow down.")
+            return
+        if verdict == flood.BAN:
+            if await async_db.ban_user(user.id, user.username, user.first_name):
+                logger.info("Auto-banned user %s for flooding", user.id)
+                await outbox.reply(context, update.message, "🚫 You have been banned for flooding.")
+            return
+    
     # Check for payment screenshot
     if context.user_data.get('awaiting_payment_screenshot') and update.message.photo:
         await clone_handlers.handle_payment_screenshot(update, context)
@@ -39,9 +66,8 @@ async def handle_all_messages(update, context):
     
     # Check for owner setting UPI after QR
     if user.id == OWNER_ID and context.user_data.get('payment_qr') and update.message.text:
-        import database as db
-        db.set_payment_info(context.user_data['payment_qr'], update.message.text.strip())
-        await update.message.reply_text("✅ Payment info saved!")
+        await async_db.set_payment_info(context.user_data['payment_qr'], update.message.text.strip())
+        await outbox.reply(context, update.message, "✅ Payment info saved!")
         context.user_data['payment_qr'] = None
         context.user_data['awaiting_payment_info'] = False
         return
@@ -52,11 +78,47 @@ async def handle_all_messages(update, context):
     else:
         await user_handlers.handle_media(update, context)
 
+async def on_startup(application):
+    async_db.start()
+    application.bot_data['outbox'] = outbox.Outbox(application.bot)
+    application.bot_data['outbox'].start()
+    await broadcast.resume_jobs(application.bot_data['outbox'])
+    application.bot_data['eviction'].start()
+    # Clone bots run on this loop; they start in the background
+    clone_runtime.start(application)
+
+async def on_stop(application):
+    await clone_runtime.stop()
+    application.bot_data['eviction'].stop()
+    # Let updates still being handled finish while the outbox is up
+    await application.update_processor.drain()
+    await user_handlers.wait_forwards(application.bot.id)
+    await broadcast.stop_jobs()
+    await application.bot_data['outbox'].stop()
+
+async def on_shutdown(application):
+    await async_db.close()
+
 def main():
     """Start the bot."""
     init_db()
     
-    application = Application.builder().token(BOT_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .update_queue(UpdateQueue(UPDATE_QUEUE_SIZE, max_taken=UPDATE_QUEUE_SIZE))
+        .concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+        .persistence(SQLitePersistence())
+        .context_types(ContextTypes(user_data=UserState, chat_data=UserState))
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
+    
+    # Track activity for idle user_data eviction; runs before every other handler
+    eviction = application.bot_data['eviction'] = IdleEviction(application)
+    application.add_handler(TypeHandler(Update, eviction.touch), group=-1)
     
     # Owner commands
     application.add_handler(CommandHandler("start", owner_handlers.start_command))
@@ -71,7 +133,7 @@ def main():
     application.add_handler(CommandHandler("verify", owner_handlers.verify_payments))
     
     # Callback query handler
-    application.add_handler(CallbackQueryHandler(handle_callback))
+    application.add_handler(CallbackQueryHandler(callbacks.dispatch))
     
     # Message handlers
     application.add_handler(MessageHandler(
@@ -79,8 +141,22 @@ def main():
         handle_all_messages
     ))
     
-    logger.info("Bot started successfully!")
-    application.run_polling(allowed_updates=["message", "callback_query"])
+    allowed_updates = ["message", "callback_query"]
+    if WEBHOOK_URL:
+        # Stopping closes the HTTP server first, then handles every update
+        # already queued before post_stop/post_shutdown run
+        logger.info("Bot started successfully! Listening for webhooks on port %s", WEBHOOK_PORT)
+        application.run_webhook(
+            listen="0.0.0.0",
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=allowed_updates
+        )
+    else:
+        logger.info("Bot started successfully!")
+        application.run_polling(allowed_updates=allowed_updates)
 
 if __name__ == '__main__':
     main()
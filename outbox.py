@@ -0,0 +1,222 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Priorities, lowest value first
+HIGH = 0    # owner replies and payment notices
+NORMAL = 1  # forwards to the owner, greetings, command responses
+LOW = 2     # broadcasts
+
+GLOBAL_RATE = 25         # messages/second, a little under Telegram's ~30/s bot limit
+PER_CHAT_INTERVAL = 1.0  # seconds between messages to the same chat
+CONCURRENCY = 16         # API calls in flight at once
+MAX_ATTEMPTS = 4         # tries per message for network errors
+BACKOFF_BASE = 0.5       # seconds; doubled per attempt, with jitter
+
+class TokenBucket:
+    """Async token bucket; pause() stops every sender, e.g. after a 429."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+class _Job:
+    __slots__ = ('chat_id', 'func', 'args', 'kwargs', 'priority', 'future', 'attempts', 'enqueued_at')
+
+    def __init__(self, chat_id, func, args, kwargs, priority, future):
+        self.chat_id = chat_id
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.future = future
+        self.attempts = 0
+        self.enqueued_at = time.monotonic()
+
+class Sender:
+    """Bot look-alike whose chat methods (send_*, copy_message, ...) go through an Outbox."""
+
+    def __init__(self, outbox, priority):
+        self._outbox = outbox
+        self._priority = priority
+
+    def __getattr__(self, name):
+        method = getattr(self._outbox.bot, name)
+
+        async def call(*args, **kwargs):
+            chat_id = kwargs['chat_id'] if 'chat_id' in kwargs else args[0]
+            return await self._outbox.send(chat_id, method, *args, priority=self._priority, **kwargs)
+
+        return call
+
+class Outbox:
+    """Single outbound queue per bot enforcing global and per-chat rate limits.
+
+    Jobs are served by priority, then FIFO. A job whose chat was used less than
+    PER_CHAT_INTERVAL ago waits in a delayed heap without blocking other chats.
+    """
+
+    def __init__(self, bot, rate=GLOBAL_RATE, per_chat_interval=PER_CHAT_INTERVAL, concurrency=CONCURRENCY):
+        self.bot = bot
+        self.bucket = TokenBucket(rate)
+        self.per_chat_interval = per_chat_interval
+        self._slots = asyncio.Semaphore(concurrency)
+        self._ready = []    # (priority, seq, job)
+        self._delayed = []  # (not_before, seq, job)
+        self._chat_free_at = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._in_flight = set()
+        self._dispatcher = None
+        self.metrics = {'enqueued': 0, 'sent': 0, 'failed': 0, 'retried': 0, 'latency_avg': 0.0, 'latency_max': 0.0}
+
+    def sender(self, priority=NORMAL):
+        return Sender(self, priority)
+
+    def submit(self, chat_id, func, /, *args, priority=NORMAL, **kwargs):
+        """Queue func(*args, **kwargs) for chat_id; returns a future with its result."""
+        future = asyncio.get_running_loop().create_future()
+        job = _Job(chat_id, func, args, kwargs, priority, future)
+        heapq.heappush(self._ready, (priority, next(self._seq), job))
+        self.metrics['enqueued'] += 1
+        self._wakeup.set()
+        return future
+
+    async def send(self, chat_id, func, /, *args, priority=NORMAL, **kwargs):
+        return await self.submit(chat_id, func, *args, priority=priority, **kwargs)
+
+    def stats(self):
+        return {
+            'depth': len(self._ready) + len(self._delayed),
+            'in_flight': len(self._in_flight),
+            **self.metrics,
+        }
+
+    def start(self):
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+
+    async def stop(self, timeout=10):
+        """Give queued messages up to `timeout` seconds to go out, then stop."""
+        deadline = time.monotonic() + timeout
+        while (self._ready or self._delayed or self._in_flight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        for _, _, job in self._ready + self._delayed:
+            if not job.future.done():
+                job.future.cancel()
+        self._ready.clear()
+        self._delayed.clear()
+
+    def _requeue(self, job, delay):
+        heapq.heappush(self._delayed, (time.monotonic() + delay, next(self._seq), job))
+        self._wakeup.set()
+
+    async def _next_job(self):
+        while True:
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                _, seq, job = heapq.heappop(self._delayed)
+                heapq.heappush(self._ready, (job.priority, seq, job))
+            while self._ready:
+                _, seq, job = heapq.heappop(self._ready)
+                if job.future.done():  # caller gave up
+                    continue
+                free_at = self._chat_free_at.get(job.chat_id, 0)
+                if free_at > now:
+                    heapq.heappush(self._delayed, (free_at, seq, job))
+                    continue
+                self._chat_free_at[job.chat_id] = now + self.per_chat_interval
+                if len(self._chat_free_at) > 10000:
+                    self._chat_free_at = {c: t for c, t in self._chat_free_at.items() if t > now}
+                return job
+            self._wakeup.clear()
+            timeout = self._delayed[0][0] - now if self._delayed else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _dispatch(self):
+        while True:
+            job = await self._next_job()
+            await self.bucket.acquire()
+            await self._slots.acquire()
+            task = asyncio.get_running_loop().create_task(self._execute(job))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _execute(self, job):
+        job.attempts += 1
+        try:
+            result = await job.func(*job.args, **job.kwargs)
+        except RetryAfter as e:
+            logger.warning("Flood limit hit, pausing outbox for %ss", e.retry_after)
+            self.bucket.pause(e.retry_after)
+            self.metrics['retried'] += 1
+            self._requeue(job, e.retry_after)
+        except (BadRequest, Forbidden) as e:
+            self._fail(job, e)
+        except NetworkError as e:
+            if job.attempts >= MAX_ATTEMPTS:
+                self._fail(job, e)
+            else:
+                self.metrics['retried'] += 1
+                self._requeue(job, BACKOFF_BASE * 2 ** (job.attempts - 1) * random.uniform(0.5, 1.5))
+        except Exception as e:
+            self._fail(job, e)
+        else:
+            latency = time.monotonic() - job.enqueued_at
+            self.metrics['sent'] += 1
+            self.metrics['latency_avg'] += (latency - self.metrics['latency_avg']) * 0.05
+            self.metrics['latency_max'] = max(self.metrics['latency_max'], latency)
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._slots.release()
+
+    def _fail(self, job, error):
+        self.metrics['failed'] += 1
+        if not job.future.done():
+            job.future.set_exception(error)
+
+def of(context):
+    """The Outbox of the application handling this update."""
+    return context.bot_data['outbox']
+
+def sender(context, priority=NORMAL):
+    return of(context).sender(priority)
+
+async def reply(context, message, text, priority=NORMAL, **kwargs):
+    """Queued replacement for message.reply_text."""
+    return await sender(context, priority).send_message(message.chat_id, text, **kwargs)
@@ -0,0 +1,133 @@
+import json
+import logging
+from copy import deepcopy
+from telegram.ext import BasePersistence, PersistenceInput
+import async_db as db
+
+logger = logging.getLogger(__name__)
+
+UPDATE_INTERVAL = 5  # seconds between PTB handing over changed user/chat data
+
+_MISSING = object()
+
+class SQLitePersistence(BasePersistence):
+    """Keeps user_data and chat_data in the conversation_state table.
+
+    Every key is its own row. PTB hands over the whole dict of each user it
+    touched; that is compared with the values last written for the user, and
+    only changed or removed keys are queued for the next write-behind flush,
+    where they go out in one executemany transaction. Values must be JSON
+    serializable; anything else is skipped with a warning. bot_data holds
+    live objects (the outbox) and is not persisted.
+
+    Nothing is loaded at startup except the ids that have stored state; a
+    user's rows are read when their next update arrives (refresh_user_data),
+    so state evicted from memory by user_state.IdleEviction comes back too.
+    """
+
+    def __init__(self, update_interval=UPDATE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, callback_data=False),
+            update_interval=update_interval
+        )
+        self._stored = {}  # (scope, owner_id) -> {key: value as last written}, loaded users only
+        self._on_disk = {'user': set(), 'chat': set()}  # ids with rows in the table
+
+    async def _load_ids(self, scope):
+        self._on_disk[scope] = await db.get_state_owners(self.bot.id, scope)
+        return {}
+
+    async def _refresh(self, scope, owner_id, data):
+        if (scope, owner_id) in self._stored or owner_id not in self._on_disk[scope]:
+            return
+        decoded = {
+            key: json.loads(value)
+            for key, value in (await db.load_owner_state(self.bot.id, scope, owner_id)).items()
+        }
+        self._stored[(scope, owner_id)] = deepcopy(decoded)
+        for key, value in decoded.items():
+            data[key] = value
+
+    async def _update(self, scope, owner_id, data):
+        # data is PTB's private deep copy, so it can be kept as the snapshot
+        # and only changed values need encoding
+        stored = self._stored.get((scope, owner_id), {})
+        upserts = {}
+        for key, value in data.items():
+            old = stored.get(key, _MISSING)
+            if type(old) is type(value) and old == value:
+                continue
+            try:
+                upserts[key] = json.dumps(value, separators=(',', ':'))
+            except TypeError:
+                logger.warning("Not persisting %s_data[%r] of %s: not JSON serializable", scope, key, owner_id)
+        deletes = [key for key in stored if key not in data]
+        if upserts or deletes:
+            self._stored[(scope, owner_id)] = data
+            if data:
+                self._on_disk[scope].add(owner_id)
+            else:
+                self._on_disk[scope].discard(owner_id)
+            await db.stage_state(self.bot.id, scope, owner_id, upserts, deletes)
+
+    async def _drop(self, scope, owner_id):
+        self._stored.pop((scope, owner_id), None)
+        if owner_id in self._on_disk[scope]:
+            self._on_disk[scope].discard(owner_id)
+            await db.drop_state(self.bot.id, scope, owner_id)
+
+    def forget(self, scope, owner_id):
+        """Drop the in-memory snapshot of an evicted user/chat; rows stay stored."""
+        self._stored.pop((scope, owner_id), None)
+
+    def stats(self):
+        return {'stored_users': len(self._on_disk['user']), 'snapshots': len(self._stored)}
+
+    async def get_user_data(self):
+        return await self._load_ids('user')
+
+    async def get_chat_data(self):
+        return await self._load_ids('chat')
+
+    async def update_user_data(self, user_id, data):
+        await self._update('user', user_id, data)
+
+    async def update_chat_data(self, chat_id, data):
+        await self._update('chat', chat_id, data)
+
+    async def drop_user_data(self, user_id):
+        await self._drop('user', user_id)
+
+    async def drop_chat_data(self, chat_id):
+        await self._drop('chat', chat_id)
+
+    async def refresh_user_data(self, user_id, user_data):
+        await self._refresh('user', user_id, user_data)
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        await self._refresh('chat', chat_id, chat_data)
+
+    async def flush(self):
+        await db.flush()
+
+    # Not stored (see PersistenceInput above)
+    async def get_bot_data(self):
+        return {}
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_conversation(self, name, key, new_state):
+        pass
@@ -0,0 +1,95 @@
+import asyncio
+from telegram import InputMediaAudio, InputMediaDocument, InputMediaPhoto, InputMediaVideo
+from telegram.helpers import effective_message_type
+
+# Message types whose caption copy_message can override
+CAPTIONED = ('photo', 'video', 'document', 'audio', 'voice', 'animation')
+
+INPUT_MEDIA = {
+    'photo': InputMediaPhoto,
+    'video': InputMediaVideo,
+    'document': InputMediaDocument,
+    'audio': InputMediaAudio,
+}
+
+ALBUM_WINDOW = 1.0  # seconds to wait for the rest of a media group
+
+_albums = {}  # (chat_id, media_group_id) -> messages received so far
+
+def with_header(header, body):
+    return f"{header}\n\n{body or ''}"
+
+def copy_caption(message, header):
+    """Caption for a copy of message, or None if its type cannot carry one."""
+    if effective_message_type(message) in CAPTIONED:
+        return with_header(header, message.caption_html)
+    return None
+
+async def relay(bot, chat_id, message, header):
+    """Relay any single message to chat_id with an HTML header attached.
+
+    Text and captionable media take one API call; other types (stickers,
+    polls, locations, ...) get the header as a separate message first.
+    """
+    if message.text:
+        return await bot.send_message(chat_id, with_header(header, message.text_html), parse_mode='HTML')
+    caption = copy_caption(message, header)
+    if caption is None:
+        await bot.send_message(chat_id, header, parse_mode='HTML')
+        return await bot.copy_message(chat_id, message.chat_id, message.message_id)
+    return await bot.copy_message(
+        chat_id, message.chat_id, message.message_id, caption=caption, parse_mode='HTML'
+    )
+
+def album_media(messages, header):
+    """Serializable description of an album: [{'type', 'file_id', 'caption'}]."""
+    media = []
+    for i, message in enumerate(messages):
+        kind = effective_message_type(message)
+        attachment = message.photo[-1] if message.photo else message.effective_attachment
+        caption = with_header(header, message.caption_html) if i == 0 else message.caption_html
+        media.append({'type': kind, 'file_id': attachment.file_id, 'caption': caption})
+    return media
+
+async def send_album(bot, chat_id, media):
+    """Send an album described by album_media() in one send_media_group call."""
+    return await bot.send_media_group(chat_id, [
+        INPUT_MEDIA[item['type']](item['file_id'], caption=item['caption'], parse_mode='HTML')
+        for item in media
+    ])
+
+async def relay_messages(bot, chat_id, messages, header):
+    """Relay a single message or a whole album collected by collect_album()."""
+    if len(messages) == 1:
+        return [await relay(bot, chat_id, messages[0], header)]
+    return await send_album(bot, chat_id, album_media(messages, header))
+
+def journal_type(messages):
+    return 'album' if len(messages) > 1 else effective_message_type(messages[0])
+
+def join_album(message):
+    """Add message to its media group's pending album; False if none is pending."""
+    key = (message.chat_id, message.media_group_id)
+    if message.media_group_id and key in _albums:
+        _albums[key].append(message)
+        return True
+    return False
+
+def collect_album(application, message, deliver):
+    """Start buffering a media group and call deliver(messages) once it is complete.
+
+    Returns False for messages that are not part of an album. The first item
+    decides where the album goes; later items are added with join_album().
+    """
+    if not message.media_group_id:
+        return False
+    key = (message.chat_id, message.media_group_id)
+    _albums[key] = [message]
+
+    async def flush():
+        await asyncio.sleep(ALBUM_WINDOW)
+        messages = sorted(_albums.pop(key), key=lambda m: m.message_id)
+        await deliver(messages)
+
+    application.create_task(flush())
+    return True
@@ -0,0 +1,76 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+def _digits(part):
+    # int() also takes "3_4", " 3" and "+3"; an id in callback data is plain digits
+    if not (part.isascii() and part.isdigit()):
+        raise ValueError(f"not an id: {part!r}")
+    return int(part)
+
+# Registered types replaced by a stricter converter
+_CONVERTERS = {int: _digits}
+
+class CallbackRouter:
+    """Dispatch table for callback_data.
+
+    Exact actions ("owner_panel") are a single dict lookup. Prefixed actions
+    ("buy_plan_<id>") are found by slicing data at each registered prefix
+    length, longest first, so the cost depends on how many distinct prefix
+    lengths exist, not on how many actions are registered. Whatever follows
+    the prefix is split on "_" and converted with the given types; the last
+    argument takes the rest, so it may itself contain "_". An int argument
+    must be plain ASCII digits.
+    """
+
+    def __init__(self):
+        self._exact = {}
+        self._prefixes = {}  # prefix -> (handler, types)
+        self._lengths = []   # distinct prefix lengths, longest first
+
+    def add(self, data, handler):
+        self._exact[data] = handler
+
+    def add_prefix(self, prefix, handler, *types):
+        types = tuple(_CONVERTERS.get(convert, convert) for convert in types)
+        self._prefixes[prefix] = (handler, types)
+        self._lengths = sorted({len(p) for p in self._prefixes}, reverse=True)
+
+    def include(self, other):
+        for data, handler in other._exact.items():
+            self.add(data, handler)
+        for prefix, (handler, types) in other._prefixes.items():
+            self.add_prefix(prefix, handler, *types)
+
+    def resolve(self, data):
+        """Return (handler, args) for data, or None if nothing matches."""
+        handler = self._exact.get(data)
+        if handler is not None:
+            return handler, ()
+        for length in self._lengths:
+            if length > len(data):
+                continue
+            entry = self._prefixes.get(data[:length])
+            if entry is None:
+                continue
+            handler, types = entry
+            if not types:
+                return handler, ()
+            parts = data[length:].split("_", len(types) - 1)
+            if len(parts) != len(types):
+                return None
+            try:
+                return handler, tuple([convert(part) for convert, part in zip(types, parts)])
+            except ValueError:
+                return None
+        return None
+
+    async def dispatch(self, update, context):
+        query = update.callback_query
+        route = self.resolve(query.data or "")
+        if route is None:
+            logger.debug("Unhandled callback %r", query.data)
+            await query.answer()
+            return
+        handler, args = route
+        await handler(update, context, *args)
@@ -0,0 +1,150 @@
+"""Every query in database.py must use an index.
+
+Each public function runs once against a fresh database built by
+init_db(), with every statement traced; each traced statement is then
+checked with EXPLAIN QUERY PLAN. A SCAN is only accepted on the small
+fixed-size tables, or through a partial index, which only holds the rows
+its WHERE clause selects.
+"""
+import inspect
+import re
+
+import pytest
+
+import database
+
+SMALL_TABLES = {'stats_counters', 'subscription_plans', 'payment_info'}
+
+PARTIAL_INDEXES = {
+    re.search(r'INDEX IF NOT EXISTS (\w+)', index).group(1)
+    for index in database.INDEXES if ' WHERE ' in index
+}
+
+NOT_QUERIES = ('PRAGMA', 'BEGIN', 'COMMIT', 'ROLLBACK', 'CREATE', 'SAVEPOINT', 'RELEASE')
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    database.close_db()
+    monkeypatch.setattr(database, 'DB_NAME', str(tmp_path / 'test.db'))
+    database.init_db()
+    yield database
+    database.close_db()
+
+def _public_functions():
+    return {
+        name for name, func in inspect.getmembers(database, inspect.isfunction)
+        if func.__module__ == database.__name__ and not name.startswith('_')
+    } - {'get_db', 'close_db', 'init_db', 'cache_lookup'}
+
+def _exercise(db):
+    db.add_user(1, 'a', 'A')
+    db.add_user(2, 'b', 'B')
+    db.update_last_active(1)
+    db.flush_last_active()
+    db.is_user_banned(1)
+    db.get_ban_stats()
+    db.ban_user(2)
+    db.ban_user(3, 'c', 'C')
+    db.unban_user(2)
+    db.mark_users_unreachable([2])
+    db.get_user_count()
+    db.get_stats()
+    db.get_users_page()
+    db.get_users_page(banned=True, after=1)
+    db.get_users_page(before=5)
+    db.get_recipient_ids()
+    list(db.iter_recipient_chunks())
+
+    db.ban_in_bot(1, 3)
+    db.is_banned_in_bot(1, 3)
+    db.unban_in_bot(1, 3)
+
+    db.add_subscription_plan('Monthly', 30, 100)
+    plan_id = db.get_all_plans()[0]['id']
+    key = db.create_auth_key(1, plan_id)
+    db.get_pending_auth_key(key)
+    db.bot_token_in_use('1:token')
+    db.activate_auth_key(key, '1:token')
+    db.get_active_auth_keys_page()
+    db.get_active_auth_keys_page(after=key)
+    db.get_active_auth_keys_page(before=key)
+    db.get_clone_bots()
+    db.expire_auth_keys()
+    db.revoke_auth_key(key)
+
+    payment_id = db.add_payment_request(1, plan_id, 'file')
+    db.get_pending_payments_page()
+    db.get_pending_payments_page(after=0)
+    db.get_pending_payments_page(before=payment_id + 1)
+    db.get_payment_by_id(payment_id)
+    db.approve_payment_and_issue_key(payment_id)
+    db.set_payment_info('qr', 'upi@bank')
+    db.get_payment_info()
+
+    job_id = db.create_broadcast_job(1, {'kind': 'text', 'text': 'hi'}, 2, 10)
+    db.checkpoint_broadcast_job(job_id, 1, 1, 0, 0)
+    db.get_running_broadcast_jobs()
+
+    db.journal_message(1, 1, 2, 'text', 'hello')
+    db.flush_journal()
+    db.prune_messages(30)
+
+    db.add_reply_routes(1, [10], 1)
+    db.flush_reply_routes()
+    db._routes.clear()  # force the database lookup
+    db.lookup_reply_route(1, 10)
+    db.get_reply_route(1, 10)
+    db.prune_reply_routes(30)
+
+    db.stage_state(1, 'user', 1, {'step': '"paid"'}, [])
+    db.flush_state()
+    db.get_state_owners(1, 'user')
+    db.load_owner_state(1, 'user', 1)
+    db.drop_state(1, 'user', 1)
+
+    db.delete_plan(plan_id)
+
+def _full_scans(conn, sql):
+    scans = []
+    for row in conn.execute('EXPLAIN QUERY PLAN ' + sql):
+        match = re.match(r'SCAN (\w+)(?: AS \w+)?(?: USING (?:COVERING )?INDEX (\w+))?', row[3])
+        if not match:
+            continue
+        table, index = match.groups()
+        if table in SMALL_TABLES or index in PARTIAL_INDEXES:
+            continue
+        scans.append(row[3])
+    return scans
+
+def test_every_query_uses_an_index(db, monkeypatch):
+    # Taken before patching: the traced wrappers are not database's own functions
+    expected = _public_functions()
+    called = set()
+    for name in expected:
+        func = getattr(db, name)
+
+        def traced(*args, _name=name, _func=func, **kwargs):
+            called.add(_name)
+            return _func(*args, **kwargs)
+
+        monkeypatch.setattr(db, name, traced)
+
+    statements = []
+    with db.get_db() as conn:
+        conn.set_trace_callback(statements.append)
+        try:
+            _exercise(db)
+        finally:
+            conn.set_trace_callback(None)
+
+        assert expected - called == set(), "add new database functions to _exercise()"
+
+        failures = {}
+        for sql in dict.fromkeys(s.strip() for s in statements):
+            # Trigger bodies are traced as comments
+            if sql.startswith('--') or sql.split(None, 1)[0].upper() in NOT_QUERIES:
+                continue
+            scans = _full_scans(conn, sql)
+            if scans:
+                failures[' '.join(sql.split())] = scans
+    assert not failures
@@ -0,0 +1,102 @@
+import asyncio
+from telegram.ext import BaseUpdateProcessor
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Handle updates concurrently while keeping each user's updates in order.
+
+    Updates from one user wait on that user's lock before taking one of the
+    max_concurrent_updates slots, so a user sending a burst queues behind
+    themselves instead of occupying every slot. asyncio.Lock wakes waiters
+    in FIFO order, which preserves arrival order. A lock only exists while
+    that user has updates in flight.
+
+    Application.stop() does not track updates it starts while draining the
+    queue, so drain() lets shutdown wait for them.
+    """
+
+    __slots__ = ("_locks", "_pending", "_idle")
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}  # user id -> [lock, updates holding or waiting for it]
+        self._pending = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def process_update(self, update, coroutine):
+        self._pending += 1
+        self._idle.clear()
+        try:
+            await self._process_in_order(update, coroutine)
+        finally:
+            self._pending -= 1
+            if not self._pending:
+                self._idle.set()
+
+    async def _process_in_order(self, update, coroutine):
+        user = getattr(update, 'effective_user', None)
+        if user is None:
+            return await super().process_update(update, coroutine)
+
+        entry = self._locks.get(user.id)
+        if entry is None:
+            entry = self._locks[user.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[user.id]
+
+    async def drain(self, timeout=30):
+        """Wait up to timeout seconds for every started update to finish."""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        await self.drain()
+
+    def active_users(self):
+        return len(self._locks)
+
+    def is_busy(self, user_id):
+        return user_id in self._locks
+
+class UpdateQueue(asyncio.Queue):
+    """Update queue that also bounds updates taken off it but not yet handled.
+
+    With concurrent updates PTB's fetcher turns every update it gets into a
+    task right away, so a bounded queue alone never fills and intake never
+    waits. get() here holds back while max_taken updates are out; PTB calls
+    task_done() as each one finishes.
+    """
+
+    def __init__(self, maxsize, max_taken):
+        super().__init__(maxsize)
+        self.max_taken = max_taken
+        self._taken = 0
+        self._returned = asyncio.Event()
+
+    async def get(self):
+        while self._taken >= self.max_taken:
+            self._returned.clear()
+            await self._returned.wait()
+        item = await super().get()
+        self._taken += 1
+        return item
+
+    def task_done(self):
+        super().task_done()
+        # PTB also marks updates it drops at shutdown as done without taking them
+        self._taken = max(0, self._taken - 1)
+        self._returned.set()
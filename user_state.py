@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import sys
+import time
+from collections import OrderedDict
+from config import USER_STATE_TTL, USER_STATE_MAX
+
+logger = logging.getLogger(__name__)
+
+SWEEP_INTERVAL = 60  # seconds between eviction passes
+
+# Application internals (python-telegram-bot 20.x) eviction reads and changes.
+# Application.drop_user_data()/drop_chat_data() are the public way to remove
+# a user's dict, but they also make the persistence delete the stored rows,
+# while eviction only releases memory. Checked up front, so a PTB upgrade that
+# changes them fails at startup instead of silently never evicting.
+_PTB_INTERNALS = {
+    '_user_data': dict,
+    '_chat_data': dict,
+    '_user_ids_to_be_updated_in_persistence': set,
+    '_chat_ids_to_be_updated_in_persistence': set,
+}
+
+class UserState(dict):
+    """user_data/chat_data dict that does not keep cleared workflow flags.
+
+    Handlers reset flags with `= None` / `= False` and read them with .get(),
+    so dropping those keys changes nothing for them. Users who are not in the
+    middle of a workflow end up with an empty dict.
+    """
+
+    __slots__ = ()
+
+    def __setitem__(self, key, value):
+        if value is None or value is False:
+            self.pop(key, None)
+        else:
+            super().__setitem__(key, value)
+
+def _size(data):
+    return sys.getsizeof(data) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in data.items())
+
+class IdleEviction:
+    """Drops the user_data/chat_data of users idle for USER_STATE_TTL seconds,
+    or the least recently seen ones beyond USER_STATE_MAX.
+
+    A user is only evicted once persistence has their latest state: never
+    while one of their updates is running or waiting to be persisted, and
+    never within two persistence intervals of their last update. Stored
+    state is read back by the persistence on the user's next update.
+    """
+
+    def __init__(self, application, ttl=USER_STATE_TTL, max_users=USER_STATE_MAX):
+        for name, kind in _PTB_INTERNALS.items():
+            if not isinstance(getattr(application, name, None), kind):
+                raise RuntimeError(
+                    f"IdleEviction relies on Application.{name} ({kind.__name__}), which this "
+                    f"python-telegram-bot version does not have; see user_state._PTB_INTERNALS"
+                )
+        self.application = application
+        self.ttl = ttl
+        self.max_users = max_users
+        self._seen = OrderedDict()  # user id -> last update time, least recent first
+        self._task = None
+        self.evicted = 0
+
+    async def touch(self, update, context):
+        """Group -1 TypeHandler: record that the user is active."""
+        user = update.effective_user
+        if user is not None:
+            self._seen[user.id] = time.monotonic()
+            self._seen.move_to_end(user.id)
+
+    def _in_use(self, user_id):
+        app = self.application
+        return (
+            app.update_processor.is_busy(user_id)
+            or user_id in app._user_ids_to_be_updated_in_persistence
+            or user_id in app._chat_ids_to_be_updated_in_persistence
+        )
+
+    def sweep(self, now=None):
+        now = time.monotonic() if now is None else now
+        persistence = self.application.persistence
+        min_idle = 2 * persistence.update_interval if persistence else 0
+        for _ in range(len(self._seen)):
+            user_id, seen = next(iter(self._seen.items()))
+            idle = now - seen
+            if idle < min_idle or (idle < self.ttl and len(self._seen) <= self.max_users):
+                break
+            if self._in_use(user_id):
+                # Still active; look at it again after its next quiet period
+                self._seen[user_id] = now
+                self._seen.move_to_end(user_id)
+                continue
+            del self._seen[user_id]
+            self.evict(user_id)
+
+    def evict(self, user_id):
+        # Private chats share the user's id, so both dicts go together
+        self.application._user_data.pop(user_id, None)
+        self.application._chat_data.pop(user_id, None)
+        persistence = self.application.persistence
+        if persistence:
+            persistence.forget('user', user_id)
+            persistence.forget('chat', user_id)
+        self.evicted += 1
+
+    def report(self):
+        user_data = self.application._user_data
+        chat_data = self.application._chat_data
+        report = {
+            'in_memory': len(user_data),
+            'with_state': sum(1 for data in user_data.values() if data),
+            'bytes': sum(map(_size, user_data.values())) + sum(map(_size, chat_data.values())),
+            'tracked': len(self._seen),
+            'evicted': self.evicted,
+        }
+        if self.application.persistence:
+            report.update(self.application.persistence.stats())
+        return report
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("User state eviction failed")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._sweep_loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None